@@ -0,0 +1,87 @@
+"""
+Benchmarks MD5 hex TEXT identity keys against the same digests stored as 16-byte UUIDs.
+
+    python benchmarks/bench_keys.py --rows 100000 1000000
+
+Rows are COPY loaded into scratch tables shaped like logs, with the log_id primary key and the
+character_id and receiver_id indexes, then loaded again to time the ON CONFLICT probes alone.
+The tables are dropped afterwards.
+"""
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bench_loader import DEFAULT_DSN, chunks, generate_rows
+from insights.loader import LOG_COLUMNS, copy_insert
+
+BATCH_SIZE = 10000
+KEY_TYPES = {"bench_keys_text": "TEXT", "bench_keys_uuid": "UUID"}
+
+
+def create_table(conn, table, key_type):
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute(f"""CREATE TABLE {table} (
+                        log_type TEXT,
+                        time TIMESTAMPTZ,
+                        character TEXT,
+                        receiver TEXT,
+                        total INTEGER,
+                        location TEXT,
+                        log_id {key_type} PRIMARY KEY,
+                        character_id {key_type},
+                        receiver_id {key_type})""")
+    cursor.execute(f"CREATE INDEX ON {table} (character_id)")
+    cursor.execute(f"CREATE INDEX ON {table} (receiver_id)")
+    conn.commit()
+
+
+def load(conn, table, rows):
+    for batch in chunks(rows, BATCH_SIZE):
+        copy_insert(conn, table, LOG_COLUMNS, batch, "log_id")
+        conn.commit()
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count:>9} rows {elapsed:>8.2f}s {count / elapsed:>12,.0f} rows/s", flush=True)
+
+
+def print_sizes(conn, table):
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_table_size(%s), pg_indexes_size(%s)", (table, table))
+    table_size, index_size = cursor.fetchone()
+    print(f"{table:<28} table {table_size / 2 ** 20:>8.1f} MiB indexes {index_size / 2 ** 20:>8.1f} MiB", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=DEFAULT_DSN)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        for count in args.rows:
+            print(f"{count} rows", flush=True)
+            for table, key_type in KEY_TYPES.items():
+                create_table(conn, table, key_type)
+                timed(f"{key_type} insert", count, lambda: load(conn, table, generate_rows(count)))
+                timed(f"{key_type} conflicting insert", count, lambda: load(conn, table, generate_rows(count)))
+                print_sizes(conn, table)
+    finally:
+        cursor = conn.cursor()
+        for table in KEY_TYPES:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
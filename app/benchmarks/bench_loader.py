@@ -0,0 +1,109 @@
+"""
+Benchmarks the mogrify multi-row INSERT against the COPY staging loader.
+
+    python benchmarks/bench_loader.py --rows 100000 1000000
+
+Rows are written to scratch tables shaped like logs, which are dropped afterwards.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from insights.loader import LOG_COLUMNS, copy_insert
+
+DEFAULT_DSN = "dbname=user_logs user=adm password=supersecret host=localhost port=5432"
+BATCH_SIZE = 1000
+
+
+def generate_rows(count):
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        character = f"Player{i % 5000}"
+        receiver = f"Player{(i * 7) % 5000}"
+        log_time = (start + timedelta(seconds=i // 10)).strftime('%Y-%m-%d %H:%M:%S')
+        log = ["Damage", log_time, character, receiver, str(i % 9999), "Halcyona"]
+        yield (log[0], log[1], log[2], log[3], int(log[4]), log[5],
+               hashlib.md5((",".join(log) + str(i)).encode()).hexdigest(),
+               hashlib.md5(character.encode()).hexdigest(), hashlib.md5(receiver.encode()).hexdigest())
+
+
+def create_table(conn, table):
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute(f"""CREATE TABLE {table} (
+                        log_type TEXT,
+                        time TEXT,
+                        character TEXT,
+                        receiver TEXT,
+                        total INTEGER,
+                        location TEXT,
+                        log_id TEXT PRIMARY KEY,
+                        character_id TEXT,
+                        receiver_id TEXT)""")
+    conn.commit()
+
+
+def chunks(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_mogrify(conn, table, rows):
+    cursor = conn.cursor()
+    for batch in chunks(rows, BATCH_SIZE):
+        args_str = ','.join(cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s)", x).decode() for x in batch)
+        cursor.execute(f"INSERT INTO {table} ({', '.join(LOG_COLUMNS)}) VALUES " + args_str + " ON CONFLICT (log_id) DO NOTHING;")
+        conn.commit()
+
+
+def load_copy(conn, table, rows, batch_size=None):
+    batches = chunks(rows, batch_size) if batch_size else [rows]
+    for batch in batches:
+        copy_insert(conn, table, LOG_COLUMNS, batch, "log_id")
+        conn.commit()
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count:>9} rows {elapsed:>8.2f}s {count / elapsed:>12,.0f} rows/s", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dsn", default=DEFAULT_DSN)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    tables = ["bench_logs_mogrify", "bench_logs_copy", "bench_logs_copy_stream"]
+    try:
+        for count in args.rows:
+            for table in tables:
+                create_table(conn, table)
+            timed(f"mogrify ({BATCH_SIZE}/batch)", count, lambda: load_mogrify(conn, tables[0], generate_rows(count)))
+            timed("copy (10000/batch)", count, lambda: load_copy(conn, tables[1], generate_rows(count), 10000))
+            timed("copy (single stream)", count, lambda: load_copy(conn, tables[2], generate_rows(count)))
+    finally:
+        cursor = conn.cursor()
+        for table in tables:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Benchmarks the shared insights.parser against the previous per-entry-point parsers, in lines/sec.
+
+    python benchmarks/bench_parser.py --lines 200000 1000000
+    python benchmarks/bench_parser.py --combat Combat.log --misc Misc.log
+
+Without log files, synthetic Combat.log and Misc.log lines are generated. The file readers are compared
+too: decoding every line read from disk against the mmap reader decoding only marker lines.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from insights import parser
+
+LOCATIONS = ["Halcyona", "Hasla", "Diamond Shores", "Sea of Graves"]
+
+
+def generate_combat_lines(count):
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        log_time = (start + timedelta(seconds=i // 20)).strftime('%Y-%m-%d %H:%M:%S')
+        character = f"|cff00ff00Player{i % 5000}"
+        receiver = f"|cff00ff00Player{(i * 7) % 5000}"
+        if i % 3 == 0:
+            yield f"<{log_time}{character}|r targeted {receiver}|r using |cff25fcffHeal|r to restore |cff00ff00{i % 9999}|r health.\n"
+        elif i % 3 == 1:
+            yield f"<{log_time}{character}|r attacked {receiver}|r using |cff25fcffFlame Bolt|r and caused |cffff0000-{i % 9999}|r Health Damage.\n"
+        else:
+            yield f"<{log_time}{character}|r gained the buff: Inspire.\n"
+
+
+def generate_misc_lines(count):
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        log_time = (start + timedelta(seconds=i * 30)).strftime('%Y-%m-%d %H:%M:%S')
+        location = LOCATIONS[(i // 20) % len(LOCATIONS)]
+        if i % 20 == 0:
+            yield f"<{log_time}Entering Chat: 4.Shout. {location}\n"
+        elif i % 20 == 19:
+            yield f"<{log_time}Leaving Chat: 4.Shout. {location}\n"
+        else:
+            yield f"<{log_time}You have acquired Gilda Star x{i % 10}.\n"
+
+
+def read_lines(path, encoding, limit):
+    with open(path, "r", encoding=encoding, errors="replace") as file:
+        return [line for _, line in zip(range(limit), file)]
+
+
+def legacy_parse_combat(lines):
+    """
+    The per-line strptime parser previously copied in cron.py and front.py.
+    """
+    combat_logs = []
+    damage_regex = re.compile(r"<(?P<log_time_str>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?P<character>.*?)\|r attacked (?P<receiver>.*?)\|r using \|cff25fcff(.*?)\|r and caused \|cffff0000\-(?P<total>\d+)")
+    heal_regex = re.compile(r"<(?P<log_time_str>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?P<character>.*?)\|r targeted (?P<receiver>[^|]+)\|[^|]+\|cff25fcff(?P<ability>[^|]+)\|[^|]+\|cff00ff00(?P<restored>[^|]+)\|r health.")
+    for line in lines:
+        if "attacked" in line:
+            match_damage = damage_regex.search(line)
+            if match_damage:
+                log_time_str, character, receiver, _, total = match_damage.groups()
+                timestamp = datetime.strptime(log_time_str, '%Y-%m-%d %H:%M:%S')
+                combat_logs.append(("Damage", timestamp, character.strip(), receiver.strip(), total.strip()))
+                continue
+        if "targeted" in line:
+            match_heal = heal_regex.search(line)
+            if match_heal:
+                log_time_str, character, receiver, _, restored = match_heal.groups()
+                timestamp = datetime.strptime(log_time_str, '%Y-%m-%d %H:%M:%S')
+                combat_logs.append(("Heal", timestamp, character.strip(), receiver.strip(), restored.strip()))
+    return combat_logs
+
+
+def legacy_parse_location(lines):
+    """
+    The uncompiled re.match parser previously copied in cron.py and front.py.
+    """
+    sessions = []
+    open_sessions = {}
+    regex_enter = r"<(?P<log_timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})Entering Chat: \d+\.(?P<filter>Shout)\. (?P<log_location>[\w\s]+)"
+    regex_leave = r"<(?P<log_timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})Leaving Chat: \d+\.(?P<filter>Shout)\. (?P<log_location>[\w\s]+)"
+    for line in lines:
+        if line.startswith('BackupNameAttachment'):
+            continue
+        match_enter = re.match(regex_enter, line)
+        if match_enter:
+            log_timestamp, _, log_location = match_enter.groups()
+            timestamp = datetime.strptime(log_timestamp, '%Y-%m-%d %H:%M:%S')
+            open_sessions[log_location.strip()] = len(sessions)
+            sessions.append([log_location.strip(), timestamp, None])
+            continue
+        match_leave = re.match(regex_leave, line)
+        if match_leave:
+            log_timestamp, _, log_location = match_leave.groups()
+            timestamp = datetime.strptime(log_timestamp, '%Y-%m-%d %H:%M:%S')
+            session = open_sessions.pop(log_location.strip(), None)
+            if session is not None:
+                sessions[session][2] = timestamp
+    return [tuple(session) for session in sessions]
+
+
+def read_all_lines(path, markers):
+    """
+    The previous reader, every line is decoded before the marker check.
+    """
+    tokens = [marker.decode() for marker in markers]
+    with open(path, "rb") as file:
+        return sum(1 for raw_line in file if any(token in raw_line.decode(parser.LOG_ENCODING, errors="replace") for token in tokens))
+
+
+def read_candidate_lines(path, markers):
+    with parser.map_log_file(path) as data:
+        return sum(1 for _ in parser.candidate_lines(data, markers))
+
+
+def write_lines(lines):
+    file = tempfile.NamedTemporaryFile("w", encoding=parser.LOG_ENCODING, suffix=".log", delete=False)
+    with file:
+        file.writelines(lines)
+    return file.name
+
+
+def timed(label, count, func):
+    parser.parse_timestamp.cache_clear()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count:>9} lines {elapsed:>8.2f}s {count / elapsed:>12,.0f} lines/s", flush=True)
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--lines", type=int, nargs="+", default=[200000, 1000000])
+    arg_parser.add_argument("--combat", help="Combat.log to read instead of synthetic lines")
+    arg_parser.add_argument("--misc", help="Misc.log to read instead of synthetic lines")
+    args = arg_parser.parse_args()
+
+    for count in args.lines:
+        combat_lines = read_lines(args.combat, "utf8", count) if args.combat else list(generate_combat_lines(count))
+        misc_lines = read_lines(args.misc, "ISO-8859-1", count) if args.misc else list(generate_misc_lines(count))
+
+        legacy_logs = timed("legacy parse_combat", len(combat_lines), lambda: legacy_parse_combat(combat_lines))
+        logs = timed("parser.parse_combat", len(combat_lines), lambda: list(parser.parse_combat(combat_lines)))
+        legacy_sessions = timed("legacy parse_location", len(misc_lines), lambda: legacy_parse_location(misc_lines))
+        sessions = timed("parser.parse_location", len(misc_lines), lambda: parser.parse_location(enumerate(misc_lines)))
+
+        assert logs == legacy_logs, "combat logs differ from the legacy parser"
+        assert [session[:3] for session in sessions] == legacy_sessions, "sessions differ from the legacy parser"
+
+        for label, path, lines, markers in [("Combat.log", args.combat, combat_lines, parser.COMBAT_MARKERS),
+                                            ("Misc.log", args.misc, misc_lines, parser.LOCATION_MARKERS)]:
+            file_path = path or write_lines(lines)
+            try:
+                decoded = timed(f"{label} decode all", len(lines), lambda: read_all_lines(file_path, markers))
+                mapped = timed(f"{label} mmap candidates", len(lines), lambda: read_candidate_lines(file_path, markers))
+            finally:
+                if not path:
+                    os.remove(file_path)
+            if not path:
+                assert decoded == mapped, f"{label} readers found a different number of lines"
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,53 @@
 import functools
-import re
+import os
 import hashlib
-from datetime import datetime
+import sys
+from datetime import datetime, timedelta
 import psycopg2
+from psycopg2.extras import execute_values
 import schedule
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from insights import parser
+from insights.archive import export_pending_archives
+from insights.db import bump_data_version, get_pool
+from insights.loader import chunked, copy_location_logs, copy_logs, copy_users
+from insights.partitions import (LOGS_TABLE_DDL, create_upcoming_log_partitions, detach_old_log_partitions,
+                                 ensure_log_partitions, retention_cutoff)
+from insights.rollups import create_rollup_tables, prune_log_rollups, refresh_log_rollups
+from insights.scheduler import Scheduler, job_interval
+from insights.users import UserDirectory
+
+DB_HOST = "localhost"
 COMBAT_LOG = "C:\\Users\\orlan\\Documents\\ArcheRage\\Combat.log"
 MISC_LOG = "C:\\Users\\orlan\\Documents\\ArcheRage\\Misc.log"
 OUTPUT_DIR = "output"
+TAIL_MODE = True
+BATCH_SIZE = 10000
+OPEN_SESSION_TIMEOUT = timedelta(hours=6)
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", os.cpu_count() or 1))  # 1 parses Combat.log serially
+PARALLEL_PARSE_MIN_BYTES = 64 * 1024 * 1024  # smaller spans are parsed serially, workers don't pay off
+FACTION_CHECKPOINT = f"{MISC_LOG}#factions"  # log_offsets key of the Misc.log kills read by import_users
+FACTION_PAGE_SIZE = 1000  # players upserted per statement
+USER_DIRECTORY = UserDirectory()  # user name hashes known to this process, warmed from users on startup
+DROP_EXPORTED_ARCHIVES = os.environ.get("DROP_EXPORTED_ARCHIVES") == "1"  # keep only the Parquet copy of archived weeks
+LIVE_MODE = os.environ.get("LIVE_MODE") == "1"  # follow Combat.log and import appended combat within seconds
+LIVE_POLL_SECONDS = float(os.environ.get("LIVE_POLL_SECONDS", 2))
+LIVE_BATCH_SIZE = 1000  # rows committed at once by the live import
+LIVE_STATE = {}  # Combat.log (inode, offset) read by the live import, ahead of the checkpoints
+LIVE_LOGS_DDL = '''CREATE TABLE IF NOT EXISTS live_logs (
+                    log_id UUID,
+                    time TIMESTAMPTZ,
+                    PRIMARY KEY (log_id, time))'''  # rows of the live import import_logs has not settled yet
+SCHEDULER_MODE = os.environ.get("SCHEDULER_MODE", "concurrent")  # "serial" runs the jobs one after another
+# Seconds between runs of each job, overridden by <JOB_NAME>_INTERVAL environment variables
+JOB_INTERVALS = dict(
+    maintain_log_partitions=job_interval("maintain_log_partitions", 24 * 3600),
+    import_logs=job_interval("import_logs", 30 * 60),
+    import_users=job_interval("import_users", 3600),
+    update_mob_users=job_interval("update_mob_users", 3600),
+)
 
 def log_function_call(func):
     @functools.wraps(func)
@@ -20,15 +59,21 @@ def log_function_call(func):
 
 def connect_to_database():
     """
-    Connects to the PostgreSQL database.
+    Checks out a connection to the PostgreSQL database from the shared pool.
+    Use it as a context manager, the connection goes back to the pool on exit.
     """
-    return psycopg2.connect(
-        dbname="user_logs",
-        user="adm",
-        password="supersecret",
-        host="localhost",
-        port="5432"
-    )
+    return get_pool(DB_HOST).connection()
+
+def publish_data_version(log_types=None, locations=None):
+    """
+    Refreshes the report rollups and bumps the data version so the front drops its cached report queries.
+    The front pages following live changes are told which log types and locations changed, None meaning any.
+    """
+    with connect_to_database() as conn:
+        refreshed = refresh_log_rollups(conn)
+        bump_data_version(conn, log_types, locations)
+        conn.commit()
+    print(f"> {refreshed} rollup minute(s) refreshed.", flush=True)
 
 def generate_hash(string):
     """
@@ -36,149 +81,169 @@ def generate_hash(string):
     """
     return hashlib.md5(string.encode()).hexdigest()
 
-def parse_datetime(date_str):
-    """
-    Parses a datetime object from a string.
-    """
-    if date_str == 'N/A':
-        return None
-    return datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
+@log_function_call
+def parse_combat(start_time=None, end_time=None, target_name=None, offset=0, horizon=None, progress=None, end=None,
+                 workers=PARSE_WORKERS):
+    """
+    Lazily parses combat logs starting at the given byte offset.
+    Stops before the first log at or after horizon, progress['offset'] holds the offset to resume from.
+    When end is given and at least PARALLEL_PARSE_MIN_BYTES are left, the bytes up to end are parsed
+    over workers processes.
+    """
+    if progress is None:
+        progress = {}
+    progress['offset'] = offset
+    if end is not None and workers > 1 and end - offset >= PARALLEL_PARSE_MIN_BYTES:
+        for chunk_end, combat_logs in parser.parse_combat_file_parallel(COMBAT_LOG, parser.LOG_ENCODING, offset, end, workers):
+            for line_offset, combat_log in combat_logs:
+                if horizon is not None and combat_log[1] >= horizon:
+                    progress['offset'] = line_offset
+                    return
+                if parser.combat_log_matches(combat_log, start_time, end_time, target_name):
+                    yield combat_log
+            progress['offset'] = chunk_end
+        return
+    with parser.map_log_file(COMBAT_LOG) as data:
+        for line_offset, next_offset, line in parser.candidate_lines(data, parser.COMBAT_MARKERS, offset):
+            combat_log = parser.parse_combat_line(line)
+            if combat_log is not None:
+                if horizon is not None and combat_log[1] >= horizon:
+                    return
+                if parser.combat_log_matches(combat_log, start_time, end_time, target_name):
+                    yield combat_log
+            progress['offset'] = next_offset
+        progress['offset'] = parser.complete_end(data, offset)
 
-def is_within_duration(log_time, enter_time, exit_time):
-    """
-    Checks if a log time falls within the duration of entry and exit time for a location.
-    """
-    if enter_time is None or exit_time is None:
-        return False
-    return enter_time <= log_time <= exit_time
+@log_function_call
+def parse_location(offset=0):
+    """
+    Parses location logs starting at the given byte offset.
+    Returns the (location, enter, exit, enter_offset) sessions ordered by enter, the offset after the last complete line
+    and the time of the last Misc.log line, or None for an empty file.
+    Each leave closes the open session of its location, sessions never left keep exit as None.
+    """
+    with parser.map_log_file(MISC_LOG) as data:
+        lines = parser.candidate_lines(data, parser.LOCATION_MARKERS, offset)
+        sessions = parser.parse_location((line_offset, line) for line_offset, _, line in lines)
+        end = parser.complete_end(data, offset)
+        return sessions, end, parser.last_timestamp(data, 0, end)
+
+def location_resume_point(sessions, end_offset, last_time=None):
+    """
+    Finds where the next tail run has to resume reading Misc.log and the combat time horizon.
+    Combat before the horizon is settled, sessions still open or closing at the horizon are re-read next run.
+    Sessions open for longer than OPEN_SESSION_TIMEOUT, or entered again later, never got a leave line and are not waited for.
+    Without open sessions combat is settled up to last_time, the time of the last Misc.log line.
+    """
+    if not sessions:
+        return end_offset, last_time or datetime.min
+    last_event = max(exit_time or enter_time for _, enter_time, exit_time, _ in sessions)
+    last_session = {location: i for i, (location, _, _, _) in enumerate(sessions)}
+    open_sessions = [
+        session for i, session in enumerate(sessions)
+        if session[2] is None and last_session[session[0]] == i and last_event - session[1] <= OPEN_SESSION_TIMEOUT
+    ]
+    horizon = min(session[1] for session in open_sessions) if open_sessions else max(last_event, last_time or last_event)
+    resume_offset = end_offset
+    for session in open_sessions:
+        resume_offset = min(resume_offset, session[3])
+    for _, _, exit_time, enter_offset in sessions:
+        if exit_time is not None and exit_time >= horizon:
+            resume_offset = min(resume_offset, enter_offset)
+    return resume_offset, horizon
+
+def build_log_rows(merged_logs):
+    """
+    Converts merged logs into logs table rows, hashing each log once and each user name once per process.
+    """
+    user_hash = USER_DIRECTORY.user_hash
+    for merged_log in merged_logs:
+        log = list(merged_log)
+        log[1] = str(log[1].strftime('%Y-%m-%d %H:%M:%S'))
+        yield (log[0], log[1], log[2], log[3], int(log[4]), log[5], generate_hash(",".join(log)), user_hash(log[2]), user_hash(log[3]))
 
 @log_function_call
-def parse_combat(start_time=None, end_time=None, target_name=None):
+def create_database():
     """
-    Parses combat logs.
+    Creates the database and tables if they don't exist.
     """
-    combat_logs = []
-    damage_regex = re.compile(r"<(?P<log_time_str>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?P<character>.*?)\|r attacked (?P<receiver>.*?)\|r using \|cff25fcff(.*?)\|r and caused \|cffff0000\-(?P<total>\d+)")
-    heal_regex = re.compile(r"<(?P<log_time_str>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?P<character>.*?)\|r targeted (?P<receiver>[^|]+)\|[^|]+\|cff25fcff(?P<ability>[^|]+)\|[^|]+\|cff00ff00(?P<restored>[^|]+)\|r health.")
+    with connect_to_database() as conn:
+        cursor = conn.cursor()
 
-    with open(COMBAT_LOG, "r", encoding="utf8") as file:
-        for line in file:
-            try:
-                if "attacked" in line:
-                    match_damage = damage_regex.search(line)
-                    if match_damage:
-                        log_time_str, character, receiver, _, total = match_damage.groups()
-                        log_type = "Damage"
-                        timestamp = datetime.strptime(log_time_str, '%Y-%m-%d %H:%M:%S')
-                        combat_logs.append((log_type, timestamp, character.strip(), receiver.strip(), total.strip()))
-                        continue
-                
-                if "targeted" in line:
-                    match_heal = heal_regex.search(line)
-                    if match_heal:
-                        log_time_str, character, receiver, _, restored = match_heal.groups()
-                        log_type = "Heal"
-                        timestamp = datetime.strptime(log_time_str, '%Y-%m-%d %H:%M:%S')
-                        combat_logs.append((log_type, timestamp, character.strip(), receiver.strip(), restored.strip()))
-                        continue
-            except UnicodeDecodeError:
-                pass
-    
-    # Filter logs based on start_time, end_time, and target_name
-    if start_time:
-        combat_logs = [log for log in combat_logs if log[1] >= start_time]
-    if end_time:
-        combat_logs = [log for log in combat_logs if log[1] <= end_time]
-    if target_name:
-        combat_logs = [log for log in combat_logs if log[3] == target_name]
+        # Create users table if it doesn't exist
+        cursor.execute('''CREATE TABLE IF NOT EXISTS users (
+                            user_hash UUID PRIMARY KEY,
+                            user_name TEXT,
+                            faction TEXT)''')
 
-    return combat_logs
+        # Create the partitioned logs table and its upcoming weekly partitions if they don't exist
+        cursor.execute(LOGS_TABLE_DDL)
+        create_upcoming_log_partitions(conn)
 
-@log_function_call
-def parse_location():
-    """
-    Parses location logs.
-    """
-    location_logs = {}
-    regex_enter = r"<(?P<log_timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})Entering Chat: \d+\.(?P<filter>Shout)\. (?P<log_location>[\w\s]+)"
-    regex_leave = r"<(?P<log_timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})Leaving Chat: \d+\.(?P<filter>Shout)\. (?P<log_location>[\w\s]+)"
+        # Create log_offsets table if it doesn't exist
+        cursor.execute('''CREATE TABLE IF NOT EXISTS log_offsets (
+                            file_path TEXT PRIMARY KEY,
+                            inode BIGINT,
+                            size BIGINT,
+                            byte_offset BIGINT,
+                            updated_at TEXT)''')
 
-    with open(MISC_LOG, "r", encoding='ISO-8859-1') as file:
-        for line in file:
-            try:
-                if line.startswith('BackupNameAttachment'):
-                    continue
-                match_enter = re.match(regex_enter, line)
-                if match_enter:
-                    log_timestamp, _, log_location = match_enter.groups()
-                    timestamp = datetime.strptime(log_timestamp, '%Y-%m-%d %H:%M:%S')
-                    log_location = log_location.strip()  # Remove leading and trailing whitespace
-                    if log_location in location_logs:
-                        location_logs[log_location]['enter'] = timestamp
-                    else:
-                        location_logs[log_location] = {'enter': timestamp}
-                    continue
-                
-                match_leave = re.match(regex_leave, line)
-                if match_leave:
-                    log_timestamp, _, log_location = match_leave.groups()
-                    timestamp = datetime.strptime(log_timestamp, '%Y-%m-%d %H:%M:%S')
-                    log_location = log_location.strip()  # Remove leading and trailing whitespace
-                    if log_location in location_logs:
-                        location_logs[log_location]['exit'] = timestamp
-                    else:
-                        location_logs[log_location] = {'exit': timestamp}
-            except UnicodeDecodeError:
-                pass
-    return location_logs
+        # Create data_version table if it doesn't exist
+        cursor.execute('''CREATE TABLE IF NOT EXISTS data_version (
+                            id INTEGER PRIMARY KEY,
+                            version BIGINT NOT NULL,
+                            updated_at TEXT)''')
 
-@log_function_call
-def merge_logs():
-    """
-    Merges combat and location logs.
-    """
-    location_logs = parse_location()
-    insert_location_logs(location_logs)
-    combat_logs = parse_combat()
+        # Create live_logs table if it doesn't exist
+        cursor.execute(LIVE_LOGS_DDL)
 
-    merged_logs = []
-    for combat_log in combat_logs:
-        log_time = combat_log[1]
-        for location, times in location_logs.items():
-            if is_within_duration(log_time, times.get('enter'), times.get('exit')):
-                merged_logs.append(combat_log + (location,))
-                break
+        # Create the report rollup tables if they don't exist
+        create_rollup_tables(conn)
 
-    return merged_logs
+        conn.commit()
 
-@log_function_call
-def create_database():
+def get_log_checkpoint(conn, file_path):
     """
-    Creates the database and tables if they don't exist.
+    Gets the stored (inode, size, byte_offset) checkpoint for a log file.
     """
-    conn = connect_to_database()
     cursor = conn.cursor()
+    cursor.execute("SELECT inode, size, byte_offset FROM log_offsets WHERE file_path = %s", (file_path,))
+    return cursor.fetchone()
 
-    # Create users table if it doesn't exist
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                        user_hash TEXT PRIMARY KEY,
-                        user_name TEXT,
-                        faction TEXT)''')
-
-    # Create logs table if it doesn't exist
-    cursor.execute('''CREATE TABLE IF NOT EXISTS logs (
-                        log_type TEXT,
-                        time TEXT,
-                        character TEXT,
-                        receiver TEXT,
-                        total INTEGER,
-                        location TEXT,
-                        log_id TEXT PRIMARY KEY,
-                        character_id TEXT,
-                        receiver_id TEXT)''')
+def save_log_checkpoint(conn, file_path, inode, size, byte_offset):
+    """
+    Stores the checkpoint of a log file after a successful import.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO log_offsets (file_path, inode, size, byte_offset, updated_at)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (file_path) DO UPDATE SET
+            inode = EXCLUDED.inode, size = EXCLUDED.size,
+            byte_offset = EXCLUDED.byte_offset, updated_at = EXCLUDED.updated_at;
+        """, (file_path, inode, size, byte_offset, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    )
 
-    conn.commit()
-    conn.close()
+def log_file_reset(checkpoint, stat):
+    """
+    Checks if a log file was rotated or truncated since its checkpoint.
+    """
+    inode, size, byte_offset = checkpoint
+    if inode != stat.st_ino:
+        print("Log file was rotated, rescanning.", flush=True)
+        return True
+    if stat.st_size < byte_offset or stat.st_size < size:
+        print("Log file was truncated, rescanning.", flush=True)
+        return True
+    return False
+
+def resolve_log_offset(checkpoint, stat):
+    """
+    Returns the offset to resume a log file from, or 0 when it has no checkpoint or was rotated or truncated.
+    """
+    if checkpoint is None or log_file_reset(checkpoint, stat):
+        return 0
+    return checkpoint[2]
 
 @log_function_call
 def insert_user_data(user_hash, user_name, faction=None):
@@ -187,155 +252,258 @@ def insert_user_data(user_hash, user_name, faction=None):
     """
     if ' ' in user_name:
         faction = 'Mob'
-    conn = connect_to_database()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO users (user_hash, user_name, faction)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (user_hash) DO NOTHING;
-        """, (user_hash, user_name, faction)
-    )
-    conn.commit()
-    conn.close()
+    with connect_to_database() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO users (user_hash, user_name, faction)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (user_hash) DO NOTHING;
+            """, (user_hash, user_name, faction)
+        )
+        conn.commit()
 
 @log_function_call
 def insert_log_data(log_data):
     """
     Inserts log data into the database.
     """
-    conn = connect_to_database()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO logs (log_type, time, character, receiver, total, location, log_id, character_id, receiver_id)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (log_id) DO NOTHING;
-        """, log_data)
-    conn.commit()
-    conn.close()
+    with connect_to_database() as conn:
+        ensure_log_partitions(conn, [log_data[1]])
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO logs (log_type, time, character, receiver, total, location, log_id, character_id, receiver_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (log_id, time) DO NOTHING;
+            """, log_data)
+        conn.commit()
     
 @log_function_call
-def import_logs():
+def import_logs(tail=TAIL_MODE):
     """
     Imports log data into the database in batches.
-    """
-    merged_logs = merge_logs()
-    batch_logs = []
-    batch_users = set()
-    for l in merged_logs:
-        log = list(l)
-        log[1] = str(log[1].strftime('%Y-%m-%d %H:%M:%S'))
-        log_hash = generate_hash(",".join(log))
-        if log_hash in batch_logs:
-            continue
+    In tail mode only the bytes appended since the last checkpoint are parsed.
+    """
+    combat_stat = os.stat(COMBAT_LOG)
+    misc_stat = os.stat(MISC_LOG)
+    combat_offset, misc_offset = 0, 0
+    if tail:
+        with connect_to_database() as conn:
+            combat_checkpoint = get_log_checkpoint(conn, COMBAT_LOG)
+            misc_checkpoint = get_log_checkpoint(conn, MISC_LOG)
+        if (combat_checkpoint is None or misc_checkpoint is None
+                or log_file_reset(combat_checkpoint, combat_stat) or log_file_reset(misc_checkpoint, misc_stat)):
+            # Locations and combat must be read from the same point, rescan both
+            combat_offset, misc_offset = 0, 0
         else:
-            batch_logs.append(log_hash)
-        log_data = (log[0], log[1], log[2], log[3], int(log[4]), log[5], log_hash, generate_hash(log[2]), generate_hash(log[3]))
-        batch_users.add((log_data[7], log[2]))
-        batch_users.add((log_data[8], log[3]))
-
-    if len(batch_users) > 0:
-        insert_batch_user_data(batch_users)
-    insert_batch_log_data(merged_logs)
+            # A stored offset of 0 is a valid resume point, e.g. a session open since the first Misc.log line
+            combat_offset, misc_offset = combat_checkpoint[2], misc_checkpoint[2]
+
+    sessions, misc_end_offset, misc_last_time = parse_location(misc_offset)
+    insert_location_logs(sessions)
+    horizon = None
+    if tail:
+        # Combat that may still fall inside an open location session is left for the next run
+        misc_end_offset, horizon = location_resume_point(sessions, misc_end_offset, misc_last_time)
+
+    # Lines flow through the pipeline one at a time and only BATCH_SIZE rows are held in memory
+    combat_progress = {}
+    combat_logs = parse_combat(offset=combat_offset, horizon=horizon, progress=combat_progress, end=combat_stat.st_size)
+    log_rows = build_log_rows(parser.merge_logs(combat_logs, sessions))
+    if insert_batch_log_data(log_rows, before_merge=settle_live_logs):
+        with connect_to_database() as conn:
+            # The span before the horizon is settled, live rows the batch did not produce again are removed
+            discard_unsettled_live_logs(conn, horizon or datetime.max)
+            if tail:
+                save_log_checkpoint(conn, COMBAT_LOG, combat_stat.st_ino, combat_stat.st_size, combat_progress['offset'])
+                save_log_checkpoint(conn, MISC_LOG, misc_stat.st_ino, misc_stat.st_size, misc_end_offset)
+            conn.commit()
+    publish_data_version()
     now = datetime.now()
     print("> ", now.strftime("%Y-%m-%d %H:%M:%S"), ": finished.", flush=True)
 
-@log_function_call
-def insert_batch_user_data(batch_users):
+def live_sessions(sessions):
+    """
+    Closes the sessions still open at the end of time, so combat is located before their leave line is written.
+    Only the last session of a location is open, and not when it was entered more than OPEN_SESSION_TIMEOUT before the last event.
+    """
+    if not sessions:
+        return sessions
+    last_event = max(exit_time or enter_time for _, enter_time, exit_time, _ in sessions)
+    last_session = {location: i for i, (location, _, _, _) in enumerate(sessions)}
+    return [
+        (location, enter_time, datetime.max, tag)
+        if exit_time is None and last_session[location] == i and last_event - enter_time <= OPEN_SESSION_TIMEOUT
+        else (location, enter_time, exit_time, tag)
+        for i, (location, enter_time, exit_time, tag) in enumerate(sessions)
+    ]
+
+def live_import():
+    """
+    Imports the combat appended to Combat.log since the previous live run in LIVE_BATCH_SIZE micro-batches,
+    located with the Misc.log sessions including the open ones, and notifies the front of the change.
+    Checkpoints are left to import_logs, which reads the same lines again later. The rows inserted here are
+    recorded in live_logs until then, so the ones import_logs locates differently can be replaced.
+    """
+    combat_stat = os.stat(COMBAT_LOG)
+    misc_stat = os.stat(MISC_LOG)
+    inode, offset = LIVE_STATE.get('combat', (None, None))
+    if inode != combat_stat.st_ino or combat_stat.st_size < offset:
+        with connect_to_database() as conn:
+            combat_checkpoint = get_log_checkpoint(conn, COMBAT_LOG)
+            misc_checkpoint = get_log_checkpoint(conn, MISC_LOG)
+        if combat_checkpoint is None or misc_checkpoint is None:
+            return  # Nothing imported yet, the first import is left to import_logs
+        offset = resolve_log_offset(combat_checkpoint, combat_stat)
+    if offset >= combat_stat.st_size:
+        LIVE_STATE['combat'] = (combat_stat.st_ino, offset)
+        return
+    with connect_to_database() as conn:
+        misc_offset = resolve_log_offset(get_log_checkpoint(conn, MISC_LOG), misc_stat)
+    sessions, _, _ = parse_location(misc_offset)
+
+    changed = dict(log_types=set(), locations=set())
+    def track_changes(log_rows):
+        for log_row in log_rows:
+            changed['log_types'].add(log_row[0])
+            changed['locations'].add(log_row[5])
+            yield log_row
+
+    combat_progress = {}
+    combat_logs = parse_combat(offset=offset, progress=combat_progress, end=combat_stat.st_size)
+    log_rows = build_log_rows(parser.merge_logs(combat_logs, live_sessions(sessions)))
+    if insert_batch_log_data(track_changes(log_rows), LIVE_BATCH_SIZE, before_merge=track_live_logs):
+        LIVE_STATE['combat'] = (combat_stat.st_ino, combat_progress['offset'])
+    if changed['log_types']:
+        publish_data_version(changed['log_types'], changed['locations'])
+
+def track_live_logs(conn, staging):
+    """
+    Records the staged live rows that are not in logs yet, until import_logs settles them.
     """
-    Inserts batch user data into the database using prepared statements.
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        INSERT INTO live_logs (log_id, time)
+        SELECT staged.log_id, staged.time FROM {staging} AS staged
+        WHERE NOT EXISTS (SELECT 1 FROM logs WHERE logs.log_id = staged.log_id AND logs.time = staged.time)
+        ON CONFLICT DO NOTHING
+    """)
+
+def settle_live_logs(conn, staging):
+    """
+    Confirms the live rows that import_logs produces again with the same log id.
     """
-    conn = connect_to_database()
     cursor = conn.cursor()
+    cursor.execute(f"""
+        DELETE FROM live_logs USING {staging} AS staged
+        WHERE live_logs.log_id = staged.log_id AND live_logs.time = staged.time
+    """)
+
+def discard_unsettled_live_logs(conn, horizon):
+    """
+    Deletes the live rows before the horizon that import_logs did not confirm, they were located
+    in a session the batch import never attributes, and marks their minutes for the next rollup refresh.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        WITH unsettled AS (
+            DELETE FROM live_logs WHERE time < %s RETURNING log_id, time
+        ), removed AS (
+            DELETE FROM logs USING unsettled
+            WHERE logs.log_id = unsettled.log_id AND logs.time = unsettled.time
+            RETURNING logs.time
+        )
+        INSERT INTO log_rollup_dirty (bucket)
+        SELECT DISTINCT date_trunc('minute', time) FROM removed
+        ON CONFLICT (bucket) DO UPDATE SET bucket = EXCLUDED.bucket
+    """, (horizon,))
+
+@log_function_call
+def insert_batch_user_data(conn, batch_users):
+    """
+    Inserts batch user data into the database through COPY.
+    """
     try:
-        args_str = ','.join(cursor.mogrify("(%s,%s)", x).decode() for x in batch_users)
-        insert_query = " INSERT INTO users (user_hash, user_name) VALUES " + args_str + "  ON CONFLICT (user_hash) DO NOTHING;"
-        cursor.execute(insert_query)
+        copy_users(conn, batch_users)
         conn.commit()
+        return True
     except Exception as e:
         print("Error inserting batch log data:", e, flush=True)
         conn.rollback()
+        return False
 
 @log_function_call
-def insert_batch_log_data(merged_logs):
-    """
-    Inserts batch log data into the database using prepared statements.
-    """
-    conn = connect_to_database()
-    batch_size = 1000
-    batch = []
-    for l in merged_logs:
-        log = list(l)
-        log[1] = str(log[1].strftime('%Y-%m-%d %H:%M:%S'))
-        log_hash = generate_hash(",".join(log))
-        log_data = (log[0], log[1], log[2], log[3], int(log[4]), log[5], log_hash, generate_hash(log[2]), generate_hash(log[3]))
-        batch.append(log_data)
-        if len(batch) >= batch_size:
-            insert_batch_log_data_single(conn, batch)
-            batch = []
-    if batch:
-        insert_batch_log_data_single(conn, batch)
-    conn.close()
+def insert_batch_log_data(log_rows, batch_size=BATCH_SIZE, before_merge=None):
+    """
+    Inserts log rows and the users not stored yet into the database, flushing every batch_size rows.
+    before_merge is handed to copy_logs. Returns False if any batch failed.
+    """
+    success = True
+    with connect_to_database() as conn:
+        if not USER_DIRECTORY.warmed:
+            USER_DIRECTORY.warm(conn)
+        for batch in chunked(log_rows, batch_size):
+            batch_users = {(log_data[7], log_data[2]) for log_data in batch}
+            batch_users.update((log_data[8], log_data[3]) for log_data in batch)
+            new_users = USER_DIRECTORY.new_users(batch_users)
+            if new_users:
+                if insert_batch_user_data(conn, new_users):
+                    USER_DIRECTORY.mark_stored(new_users)
+                else:
+                    success = False
+            success = insert_batch_log_data_single(conn, batch, before_merge) and success
+    return success
 
 @log_function_call
-def insert_batch_log_data_single(conn, batch):
+def insert_batch_log_data_single(conn, batch, before_merge=None):
     """
-    Inserts batch log data into the database using prepared statements (single insert).
+    Inserts batch log data into the database through COPY (single merge).
     """
-    cursor = conn.cursor()
     try:
-        args_str = ','.join(cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s)", x).decode() for x in batch)
-        insert_query = "INSERT INTO logs (log_type, time, character, receiver, total, location, log_id, character_id, receiver_id) VALUES " + args_str + " ON CONFLICT (log_id) DO NOTHING;"
-        cursor.execute(insert_query)
+        copy_logs(conn, batch, before_merge)
         conn.commit()
+        return True
     except Exception as e:
         print("Error inserting batch log data:", e, flush=True)
         conn.rollback()
+        return False
     
         
 def process_log_file():
-    pattern = re.compile(r'<\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(.*?) has killed (.*?), totaling \d+ kill\(s\)!')
-    conn = connect_to_database()
-    users = dict(
-        Pirate = [],
-        East = [],
-        West = []
-    )
-    nation_to_faction = dict(Nuia='West', Haranya='East', Pirate='Pirate')
-    with open(MISC_LOG, 'r', encoding='ISO-8859-1') as file:
-        for line in file:
-            match = pattern.search(line)
-            if match:
-                faction1 = nation_to_faction[match.group(1).split(' ')[0].strip()]
-                player1 = match.group(1).split(' ')[1].strip()
-                faction2 = nation_to_faction[match.group(2).split(' ')[0].strip()]
-                player2 = match.group(2).split(' ')[1].strip()
-                user_hash1 = generate_hash(player1)
-                user_hash2 = generate_hash(player2)
-                users[faction1].append((user_hash1))
-                users[faction2].append((user_hash2))
-    for faction, hashes in users.items():
-        batch = []
-        for item in hashes:
-            batch.append(item)
-            if len(batch) >= 100:
-                execute_batch_update(conn, batch, faction)
-                batch = []
-        if len(batch) > 0:
-            execute_batch_update(conn, batch, faction)
-            batch = []
-    conn.close()
-
-
-def execute_batch_update(conn, user_hashes, faction):
-    try:
-        cursor = conn.cursor()
-        user_hashes_str = ','.join(map(lambda x: f"'{x}'", user_hashes))
-        update_query = f"UPDATE users SET faction = '{faction}' WHERE user_hash IN ({user_hashes_str})"
-        cursor.execute(update_query)
-        conn.commit()
-    except Exception as e:
-        print(f"Error updating users for faction '{faction}':", e, flush=True)
-        conn.rollback()
+    """
+    Assigns the faction of the players announced in the kills appended to Misc.log since the last run.
+    Players are deduplicated in memory and upserted into users with one statement per FACTION_PAGE_SIZE players.
+    """
+    misc_stat = os.stat(MISC_LOG)
+    with connect_to_database() as conn:
+        offset = resolve_log_offset(get_log_checkpoint(conn, FACTION_CHECKPOINT), misc_stat)
+        with parser.map_log_file(MISC_LOG) as data:
+            end = parser.complete_end(data, offset, min(len(data), misc_stat.st_size))
+            lines = parser.candidate_lines(data, parser.KILL_MARKERS, offset, end)
+            factions = parser.parse_kill_factions(line for _, _, line in lines)
+        user_rows = [(USER_DIRECTORY.user_hash(player), player, faction) for player, faction in factions.items()]
+        try:
+            update_user_factions(conn, user_rows)
+            save_log_checkpoint(conn, FACTION_CHECKPOINT, misc_stat.st_ino, misc_stat.st_size, end)
+            conn.commit()
+            USER_DIRECTORY.mark_stored((user_hash, player) for user_hash, player, _ in user_rows)
+            print(f"> {len(user_rows)} player faction(s) read from {end - offset} bytes of Misc.log.", flush=True)
+        except Exception as e:
+            print("Error updating user factions:", e, flush=True)
+            conn.rollback()
+
+
+def update_user_factions(conn, user_rows):
+    """
+    Upserts (user_hash, user_name, faction) rows into users, only rows whose faction changes are written.
+    The caller commits.
+    """
+    cursor = conn.cursor()
+    execute_values(cursor, """
+        INSERT INTO users (user_hash, user_name, faction)
+        VALUES %s
+        ON CONFLICT (user_hash) DO UPDATE SET faction = EXCLUDED.faction
+        WHERE users.faction IS DISTINCT FROM EXCLUDED.faction
+        """, user_rows, template="(%s::uuid, %s, %s)", page_size=FACTION_PAGE_SIZE)
 
 
 @log_function_call
@@ -344,97 +512,124 @@ def import_users():
     Imports user data into the database at regular intervals.
     """
     process_log_file()
+    publish_data_version()
     now = datetime.now()
     print(f"> {now.strftime('%Y-%m-%d %H:%M:%S')}: finished importing users.", flush=True)
     
 @log_function_call
 def update_mob_users():
     """
-    Updates the faction column to 'Mob' for users with whitespace in their names and null faction.
+    Updates the faction column to 'Mob' for users with whitespace or only uppercase letters in their names
+    and null faction, in one UPDATE.
     """
-    conn = connect_to_database()
-    cursor = conn.cursor()
-    try:
-        select_uppercase_query = "SELECT user_hash FROM users WHERE faction IS NULL AND user_name ~ '^[A-Z\s]+$'"
-        cursor.execute(select_uppercase_query)
-        uppercase_users = [row[0] for row in cursor.fetchall()]
-        select_whitespace_query = "SELECT user_hash FROM users WHERE faction IS NULL AND user_name LIKE '% %'"
-        cursor.execute(select_whitespace_query)
-        whitespace_users = [row[0] for row in cursor.fetchall()]
-        users_to_update = set(uppercase_users + whitespace_users)
-        users_updated = 0
-        for user_hash in users_to_update:
-            update_query = "UPDATE users SET faction = 'Mob' WHERE user_hash = %s"
-            cursor.execute(update_query, (user_hash,))
-            users_updated += 1
-        conn.commit()
-        print(f"Updated {users_updated} users with entirely uppercase names or whitespace in their names to faction 'Mob'.", flush=True)
-    except Exception as e:
-        print("Error updating users:", e, flush=True)
-        conn.rollback()
-    finally:
-        conn.close()
+    with connect_to_database() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(r"""
+                UPDATE users SET faction = 'Mob'
+                WHERE faction IS NULL AND (user_name ~ '^[A-Z\s]+$' OR user_name LIKE '% %')
+                """)
+            users_updated = cursor.rowcount
+            refresh_log_rollups(conn)
+            bump_data_version(conn)
+            conn.commit()
+            print(f"Updated {users_updated} users with entirely uppercase names or whitespace in their names to faction 'Mob'.", flush=True)
+        except Exception as e:
+            print("Error updating users:", e, flush=True)
+            conn.rollback()
 
 @log_function_call
-def insert_location_logs(location_logs):
+def insert_location_logs(sessions):
     """
-    Inserts location logs into a PostgreSQL database.
+    Inserts every closed location session into a PostgreSQL database through COPY.
     """
     # Connect to the database
-    conn = connect_to_database()
-    cursor = conn.cursor()
+    with connect_to_database() as conn:
+        cursor = conn.cursor()
 
-    # Create a table if it doesn't exist
-    cursor.execute('''CREATE TABLE IF NOT EXISTS location_logs (
-                    location_hash TEXT PRIMARY KEY,
-                    location TEXT,
-                    enter TEXT,
-                    exit TEXT
-                )''')
-
-    # Insert location logs
-    for location, log_data in location_logs.items():
-        if not log_data.get('exit', None) or not log_data.get('enter', None):
-            continue
-        enter_time = str(log_data.get('enter', ''))
-        exit_time = str(log_data.get('exit', ''))
-        date1 = datetime.strptime(enter_time, "%Y-%m-%d %H:%M:%S")
-        date2 = datetime.strptime(exit_time, "%Y-%m-%d %H:%M:%S")
-        if date1 >= date2:
-            continue
-
-        location_log = [location, str(enter_time), str(exit_time)]
-        location_hash = generate_hash(",".join(location_log))
-        try:
-            cursor.execute("""
-                INSERT INTO location_logs (location_hash, location, enter, exit)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (location_hash) DO NOTHING
-            """, (location_hash, location, enter_time, exit_time))
-        except psycopg2.IntegrityError:
-            pass
-    conn.commit()
-    conn.close()
+        # Create a table if it doesn't exist
+        cursor.execute('''CREATE TABLE IF NOT EXISTS location_logs (
+                        location_hash UUID PRIMARY KEY,
+                        location TEXT,
+                        enter TIMESTAMPTZ,
+                        exit TIMESTAMPTZ
+                    )''')
+
+        # Insert location logs
+        location_rows = []
+        for location, enter_time, exit_time, *_ in sessions:
+            if exit_time is None or enter_time >= exit_time:
+                continue
+            location_log = [location, str(enter_time), str(exit_time)]
+            location_hash = generate_hash(",".join(location_log))
+            location_rows.append((location_hash, location, str(enter_time), str(exit_time)))
+        if location_rows:
+            try:
+                copy_location_logs(conn, location_rows)
+            except psycopg2.Error as e:
+                print("Error inserting location logs:", e, flush=True)
+                conn.rollback()
+        conn.commit()
 
 
 @log_function_call
+def warm_user_directory():
+    """
+    Loads the stored users into the process user directory.
+    """
+    with connect_to_database() as conn:
+        count = USER_DIRECTORY.warm(conn)
+    print(f"> {count} user(s) loaded.", flush=True)
+
+@log_function_call
+def maintain_log_partitions():
+    """
+    Creates the upcoming weekly partitions of logs, detaches the ones past the retention period along with their
+    rollups and exports the archive tables to Parquet, dropping them afterwards when DROP_EXPORTED_ARCHIVES is set.
+    """
+    with connect_to_database() as conn:
+        created = create_upcoming_log_partitions(conn)
+        archived = detach_old_log_partitions(conn)
+        prune_log_rollups(conn, retention_cutoff())
+        conn.commit()
+        exported = export_pending_archives(conn, archived, keep_existing=DROP_EXPORTED_ARCHIVES)
+        if DROP_EXPORTED_ARCHIVES:
+            cursor = conn.cursor()
+            for table_name in exported:
+                cursor.execute(f"DROP TABLE {table_name}")
+            conn.commit()
+    print(f"> {len(created)} partition(s) created, {len(archived)} archived, "
+          f"{sum(exported.values())} archived row(s) exported to Parquet.", flush=True)
+    if archived:
+        publish_data_version()
+
 def schedule_import():
     """
     Schedules the import of logs and users at regular intervals.
-    """
-    schedule.every(interval=30).minutes.do(import_logs) 
-    schedule.every().hour.do(import_users) 
-    schedule.every().hour.do(update_mob_users) 
-    schedule.run_all(delay_seconds=360)
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
+    Jobs run concurrently, each skipping a run while its previous one is still going, unless SCHEDULER_MODE is serial.
+    In LIVE_MODE, which needs the concurrent scheduler, live_import follows the logs every LIVE_POLL_SECONDS.
+    """
+    jobs = [maintain_log_partitions, import_logs, import_users, update_mob_users]
+    if SCHEDULER_MODE == "serial":
+        for job in jobs:
+            schedule.every(JOB_INTERVALS[job.__name__]).seconds.do(job)
+        schedule.run_all(delay_seconds=360)
+        while True:
+            schedule.run_pending()
+            time.sleep(60)
+    scheduler = Scheduler(get_pool(DB_HOST))
+    for job in jobs:
+        scheduler.every(JOB_INTERVALS[job.__name__], job)
+    if LIVE_MODE:
+        scheduler.every(LIVE_POLL_SECONDS, live_import, jitter=0)
+    scheduler.run_forever()
         
         
 if __name__ == "__main__":
     now = datetime.now()
     print(f"> {now.strftime('%Y-%m-%d %H:%M:%S')}: log import running.", flush=True)
     create_database()
+    warm_user_directory()
     schedule_import()
     #update_mob_users()
     #import_users()
@@ -1,5 +1,11 @@
+import base64
+import functools
 import hashlib
-import re
+import json
+import os
+import shutil
+import tempfile
+import time
 import psycopg2
 from datetime import datetime, timedelta
 from typing import List
@@ -10,12 +16,37 @@ import streamlit as st
 from streamlit_option_menu import option_menu
 from streamlit_extras.metric_cards import style_metric_cards
 from streamlit_extras.dataframe_explorer import dataframe_explorer
-from io import StringIO
 import plotly.figure_factory as ff
 import plotly.colors
 
-
-DEFAULT_TIMEZONE = 'America/Sao_Paulo'
+from insights.archive import read_log_archive
+from insights.db import DATABASE_TIMEZONE, ConnectionPool, DataChangeListener, bump_data_version, get_data_version
+from insights.jobs import FAILED, JobQueue
+from insights.loader import chunked, copy_location_logs, copy_logs, copy_users
+from insights.parser import iter_decoded_lines, merge_logs, parse_combat, parse_location
+from insights.partitions import LOGS_TABLE_DDL, create_upcoming_log_partitions
+from insights.queries import QueryFilter, execute_prepared
+from insights.rollups import create_rollup_tables, refresh_log_rollups
+
+
+DEFAULT_TIMEZONE = DATABASE_TIMEZONE
+CACHE_TTL = 600  # seconds a cached report query is served before it is run again
+CACHE_MAX_ENTRIES = 256  # results kept across all report queries, which share one cache, least recently used evicted first
+DATA_VERSION_TTL = 5  # seconds between data version checks
+TOP_USERS_LIMIT = 20  # default number of users ranked per faction on the Top users by faction report
+IMPORT_BATCH_SIZE = 10000  # uploaded log rows flushed to the database at once
+IMPORT_POLL_SECONDS = 1  # seconds between reruns of the Import page while an import job runs
+LIVE_POLL_SECONDS = 1  # seconds between live status updates, a widget interaction can interrupt the wait at each one
+# Log types each Logs report reads, live pages only rerun for changes to them, None reruns on any change
+LIVE_REPORT_LOG_TYPES = {
+    'Overview': None,
+    'Pvp damage': {'Damage'},
+    'Heals': {'Heal'},
+    'Pve damage': {'Damage'},
+    'Top users by faction': None,
+    'Explorer': {'Damage', 'Heal'},
+    'Archive': set(),
+}
 
 
 st.set_page_config(
@@ -30,41 +61,89 @@ def generate_hash(string):
     return hashlib.md5(string.encode()).hexdigest()
 
 
+@st.cache_resource
+def get_connection_pool():
+    # One pool per server process, shared by every session and rerun
+    return ConnectionPool(host="db")
+
+
 def connect_to_database():
-    return psycopg2.connect(
-        dbname="user_logs",
-        user="adm",
-        password="supersecret",
-        host="db",
-        port="5432"
-    )
+    return get_connection_pool().connection()
+
+
+@st.cache_resource
+def get_data_change_listener():
+    # One LISTEN connection per server process, shared by every live session
+    return DataChangeListener(host="db")
+
+
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def current_data_version(_conn):
+    return get_data_version(_conn)
+
+
+def normalize_cache_argument(value):
+    # Filters are order independent, so ['West', 'East'] and ['East', 'West'] share an entry
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted((normalize_cache_argument(item) for item in value), key=str))
+    return value
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def run_cached_query(_conn, _func, query_name, data_version, args, kwargs):
+    return _func(_conn, *args, **dict(kwargs))
+
+
+def cached_query(func):
+    """
+    Caches a read query by its name, the data version and its normalized filter arguments.
+    Cron and the Import page bump the data version after committing, which invalidates every entry.
+    """
+    @functools.wraps(func)
+    def wrapper(conn, *args, **kwargs):
+        args = tuple(normalize_cache_argument(arg) for arg in args)
+        kwargs = tuple(sorted((key, normalize_cache_argument(value)) for key, value in kwargs.items()))
+        return run_cached_query(conn, func, func.__name__, current_data_version(conn), args, kwargs)
+    return wrapper
+
+
+def invalidate_cached_queries(conn):
+    refresh_log_rollups(conn)
+    bump_data_version(conn)
+    conn.commit()
+    current_data_version.clear()
 
 
 def create_tables(conn):
     cursor = conn.cursor()
     cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                        user_hash TEXT PRIMARY KEY,
+                        user_hash UUID PRIMARY KEY,
                         user_name TEXT,
                         faction TEXT)''')
-    cursor.execute('''CREATE TABLE IF NOT EXISTS logs (
-                        log_type TEXT,
-                        time TEXT,
-                        character TEXT,
-                        receiver TEXT,
-                        total INTEGER,
-                        location TEXT,
-                        log_id TEXT PRIMARY KEY,
-                        character_id TEXT,
-                        receiver_id TEXT)''')
+    cursor.execute(LOGS_TABLE_DDL)
+    create_upcoming_log_partitions(conn)
     cursor.execute('''CREATE TABLE IF NOT EXISTS location_logs (
-                    location_hash TEXT PRIMARY KEY,
+                    location_hash UUID PRIMARY KEY,
                     location TEXT,
-                    enter TEXT,
-                    exit TEXT
+                    enter TIMESTAMPTZ,
+                    exit TIMESTAMPTZ
                 )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS data_version (
+                    id INTEGER PRIMARY KEY,
+                    version BIGINT NOT NULL,
+                    updated_at TEXT
+                )''')
+    create_rollup_tables(conn)
     conn.commit()
 
 
+@st.cache_resource
+def ensure_tables():
+    # Once per server process, the rollup trigger DDL locks users while it runs
+    with connect_to_database() as conn:
+        create_tables(conn)
+
+
 def save_user_faction(conn, user_name, faction):
     cursor = conn.cursor()
     user_hash = generate_hash(user_name)
@@ -74,8 +153,10 @@ def save_user_faction(conn, user_name, faction):
         ON CONFLICT (user_hash) DO UPDATE SET faction = EXCLUDED.faction;
     """, (user_hash, user_name, faction))
     conn.commit()
+    invalidate_cached_queries(conn)
 
 
+@cached_query
 def get_locations(_conn):
     cursor = _conn.cursor()
     cursor.execute("SELECT DISTINCT location FROM logs")
@@ -83,14 +164,13 @@ def get_locations(_conn):
     return [loc[0] for loc in locations]
 
 
+@cached_query
 def summarize_logs_filtered(conn, faction_filter, location_filter, start_datetime, end_datetime, log_type_filter, only_pvp=True):
     cursor = conn.cursor()
     query = """
-        SELECT logs.log_id, users.faction, logs.location, logs.log_type, logs.time, logs.character, logs.receiver, SUM(logs.total) AS total
+        SELECT logs.log_id, users.faction, logs.location, logs.log_type, logs.time, logs.character, logs.receiver, logs.total
         FROM logs 
         """
-    filters = []
-    faction = [] 
     if only_pvp is True:
         query += """ 
         JOIN users ON user_hash = logs.character_id AND faction <> 'Mob'
@@ -98,77 +178,57 @@ def summarize_logs_filtered(conn, faction_filter, location_filter, start_datetim
     else:
         query += """ 
         JOIN users ON user_hash = logs.character_id AND faction <> 'Mob' """
-    if "*" in faction_filter:
-        faction = ["East", "West", "Pirate"]
-    else:
-        for f in faction_filter:
-            if f in ["East", "West", "Pirate"]:
-                faction.append(f)
-    if faction_filter and len(faction) > 1:
-        filters.append(f"users.faction IN {tuple(faction)}")
-    elif faction_filter and len(faction) == 1:
-        filters.append(f"users.faction = '{faction[0]}'")
-    if location_filter:
-        if len(location_filter) == 1:
-            filters.append(f"logs.location = '{location_filter[0]}'")
-        else:
-            filters.append(f"logs.location IN {tuple(location_filter)}")
-    if start_datetime:
-        filters.append(f"logs.time >= '{start_datetime}'")
-    if end_datetime:
-        filters.append(f"logs.time <= '{end_datetime}'")
-    if log_type_filter:
-        filters.append(f"logs.log_type = '{log_type_filter}'")
-
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
-
-    query += " GROUP BY logs.log_id, users.faction, logs.location, logs.log_type, logs.time, logs.character, logs.receiver"
-
-    cursor.execute(query)
+    filters = report_filter(faction_filter, location_filter, start_datetime, end_datetime, log_type_filter)
+    query += filters.sql()
+
+    execute_prepared(cursor, query, filters.params)
     data = cursor.fetchall()
     df = pd.DataFrame(data, columns=["Log ID", "Faction", "Location", "Log Type", "Time",  "Character",  "Target",  "Total"])
 
     return df
 
 
+def resolve_faction_filter(faction_filter):
+    if "*" in faction_filter:
+        return ["East", "West", "Pirate"]
+    return [f for f in faction_filter if f in ["East", "West", "Pirate"]]
+
 
-def summarize_logs_filtered_on_mobs(conn, faction_filter, location_filter, start_datetime, end_datetime, log_type_filter):
+def report_filter(faction_filter, location_filter, start_datetime, end_datetime, log_type=None,
+                  faction_column="users.faction", location_column="logs.location", time_column="logs.time"):
+    """
+    Builds the QueryFilter of the report sidebar fields, a faction_filter of None skips the factions.
+    """
+    filters = QueryFilter()
+    if faction_filter is not None:
+        filters.any_of(faction_column, resolve_faction_filter(faction_filter))
+    filters.any_of(location_column, location_filter)
+    filters.at_least(time_column, start_datetime)
+    filters.at_most(time_column, end_datetime)
+    filters.equals("logs.log_type", log_type)
+    return filters
+
+
+@cached_query
+def summarize_rollup_timechart(conn, faction_filter, location_filter, start_datetime, end_datetime, log_type_filter, only_pvp=True):
+    """
+    Sums log totals per faction and minute from the log_rollup_minute table.
+    only_pvp keeps the logs whose receiver is a player, otherwise every receiver counts.
+    """
     cursor = conn.cursor()
     query = """
-        SELECT logs.log_id, char_users.faction, logs.location, logs.log_type, logs.time, logs.character, 
-	    logs.receiver, logs.total
-        FROM logs
-        JOIN users AS char_users ON char_users.user_hash = logs.character_id AND char_users.faction <> 'Mob'
-        JOIN users AS recv_users ON recv_users.user_hash = logs.receiver_id
-        """
-    filters = []
-
-    faction = []
-    if "*" in faction_filter:
-        faction = ["East", "West", "Pirate"]
-    else:
-        for f in faction_filter:
-            if f in ["East", "West", "Pirate"]:
-                faction.append(f)
-    if faction_filter and len(faction) > 1:
-        filters.append(f"char_users.faction IN {tuple(faction)}")
-    elif faction_filter and len(faction) == 1:
-        filters.append(f"char_users.faction = '{faction[0]}'")
-    for filter in location_filter:
-        if filter:
-            filters.append(f"logs.location = %s")
-    if start_datetime:
-        filters.append(f"logs.time >= %s")
-    if end_datetime:
-        filters.append(f"logs.time <= %s")
-    if log_type_filter:
-        filters.append(f"logs.log_type = '{log_type_filter}'")
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
-    cursor.execute(query, [*location_filter, start_datetime, end_datetime]) 
+        SELECT faction, bucket, SUM(total) AS total
+        FROM log_rollup_minute
+        WHERE faction <> 'Mob' AND log_type = %s"""
+    if only_pvp is True:
+        query += " AND receiver_faction <> 'Mob'"
+    filters = report_filter(faction_filter, location_filter, start_datetime, end_datetime,
+                            faction_column="faction", location_column="location", time_column="bucket")
+    query += filters.sql("AND")
+    query += " GROUP BY faction, bucket ORDER BY bucket"
+    execute_prepared(cursor, query, [log_type_filter] + filters.params)
     data = cursor.fetchall()
-    df = pd.DataFrame(data, columns=["Log ID", "Faction", "Location", "Log Type", "Time", "Character", "Target", "Total"])
+    df = pd.DataFrame(data, columns=["Faction", "Time", "Total"])
     return df
 
 
@@ -184,64 +244,72 @@ def format_number(n):
         return str('{:,.1f}{}'.format(n, suffixes[i]))
 
 
-def get_totalizers(df):
-    totalizers = df.groupby(["Faction", "Log Type"]).agg(
-        Total=('Total', 'sum'),
-        Unique_Players=('Character', 'nunique')
-    ).reset_index()
+@cached_query
+def get_totalizers(conn, faction_filter, location_filter, start_datetime, end_datetime):
+    """
+    Sums player versus player totals and counts unique players per faction and log type
+    from the log_rollup_character table.
+    """
+    cursor = conn.cursor()
+    query = """
+        SELECT users.faction, rollup.log_type, SUM(rollup.total) AS total, COUNT(DISTINCT rollup.character_id)
+        FROM log_rollup_character AS rollup
+        JOIN users ON users.user_hash = rollup.character_id AND users.faction <> 'Mob'
+        WHERE rollup.receiver_faction <> 'Mob'"""
+    filters = report_filter(faction_filter, location_filter, start_datetime, end_datetime,
+                            location_column="rollup.location", time_column="rollup.bucket")
+    query += filters.sql("AND")
+    query += " GROUP BY users.faction, rollup.log_type ORDER BY users.faction, rollup.log_type"
+    execute_prepared(cursor, query, filters.params)
+    totalizers = pd.DataFrame(cursor.fetchall(), columns=["Faction", "Log Type", "Total", "Unique_Players"])
     totalizers['Total'] = totalizers['Total'].apply(format_number)
     return totalizers
 
 
+def to_archive_time(datetime_text):
+    # Report filters are naive times in the database time zone, the archive is in UTC
+    if not datetime_text:
+        return None
+    return pd.Timestamp(datetime_text).tz_localize(DATABASE_TIMEZONE).tz_convert("UTC").to_pydatetime()
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def summarize_archive(faction_filter, location_filter, start_datetime, end_datetime, log_type, only_pvp):
+    """
+    Sums the Parquet archived logs per day and faction, and per faction and location.
+    Only the weeks in range and the time, faction, location and total columns are read.
+    """
+    table = read_log_archive(
+        ["time", "character_faction", "location", "total"],
+        start=to_archive_time(start_datetime),
+        end=to_archive_time(end_datetime),
+        factions=resolve_faction_filter(faction_filter),
+        locations=[location for location in location_filter if location],
+        log_type=log_type,
+        receiver_factions=["East", "West", "Pirate"] if only_pvp else None,
+    )
+    df = table.to_pandas()
+    if df.empty:
+        return pd.DataFrame(columns=["Faction", "Time", "Total"]), pd.DataFrame(columns=["Faction", "Location", "Total"])
+    df['time'] = df['time'].dt.tz_convert(DATABASE_TIMEZONE).dt.tz_localize(None).dt.floor('D')
+    daily = df.groupby(['character_faction', 'time'], observed=True)['total'].sum().reset_index()
+    daily.columns = ["Faction", "Time", "Total"]
+    daily['Faction'] = daily['Faction'].astype(str)
+    by_location = df.groupby(['character_faction', 'location'], observed=True)['total'].sum().reset_index()
+    by_location.columns = ["Faction", "Location", "Total"]
+    by_location = by_location.astype({"Faction": str, "Location": str})
+    by_location = by_location.sort_values("Total", ascending=False)
+    by_location['Total'] = by_location['Total'].apply(format_number)
+    return daily, by_location
+
+
 def get_default_start_time():
     current_date = datetime.now()
     default_start_time = current_date - timedelta(minutes=15)
     return default_start_time
 
 
-def summarize_logs(conn, faction_filter, location_filter, start_datetime, end_datetime, log_type_filter=None, only_pvp=True):
-    cursor = conn.cursor()
-    query = """
-        SELECT logs.log_id, users.faction, logs.location, logs.log_type, logs.time, logs.character, logs.receiver, SUM(logs.total) AS total
-        FROM logs
-        """
-    filters = []
-    factions = []
-    if only_pvp is True:
-        query += """ 
-        JOIN users ON user_hash = logs.character_id AND faction <> 'Mob'
-        JOIN users AS recv_users ON recv_users.user_hash = logs.receiver_id AND recv_users.faction <> 'Mob'"""
-    else:
-        query += """ 
-        JOIN users ON user_hash = logs.character_id AND faction <> 'Mob' """
-    for filter in faction_filter:
-        if "*" in filter:
-            factions = ['East', 'West', 'Pirate']
-        else:
-            factions.append(filter)
-    if len(factions) > 0:
-        if len(factions) == 1:
-            filters.append(f"users.faction = '{factions[0]}'")
-        else:
-            filters.append(f"users.faction IN {tuple(factions)}")
-    for filter in location_filter:
-        if filter:
-            filters.append(f"location = '{filter}'")
-    if start_datetime:
-        filters.append(f"time >= '{start_datetime}'")
-    if end_datetime:
-        filters.append(f"time <= '{end_datetime}'")
-    if log_type_filter:
-        filters.append(f"log_type = '{log_type_filter}'")
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
-    query += " GROUP BY logs.log_id, users.faction, logs.location, logs.log_type, logs.time, logs.character, logs.receiver"
-    cursor.execute(query)
-    data = cursor.fetchall()
-    df = pd.DataFrame(data, columns=["Log ID", "Faction", "Location", "Log Type", "Time",  "Character",  "Target",  "Total"])
-    return df
-
-
+@cached_query
 def get_total_counts(conn):
     cursor = conn.cursor()
     cursor.execute("SELECT COUNT(*) FROM users")
@@ -252,14 +320,19 @@ def get_total_counts(conn):
     return total_users, total_logs
 
 
-def summarize_logs_paginated(conn, faction_filter, location_filter, start_datetime, end_datetime, page_number, page_size, log_type, only_pvp):
+@cached_query
+def summarize_logs_page(conn, faction_filter, location_filter, start_datetime, end_datetime, page_size, log_type, only_pvp,
+                        page_token=None):
+    """
+    Reads a page of logs, newest first, seeking by (time, log_id) from page_token instead of skipping rows,
+    so every page costs the same. Returns (dataframe, previous page token, next page token), a token being
+    None when there is no page that way.
+    """
     cursor = conn.cursor()
     query = """
-        SELECT logs.log_id, users.faction, logs.location, logs.log_type, logs.time, logs.character, logs.receiver, SUM(logs.total) AS total
+        SELECT logs.log_id, users.faction, logs.location, logs.log_type, logs.time, logs.character, logs.receiver, logs.total
         FROM logs
         """ 
-    filters = []
-    factions = []
     if only_pvp is True:
         query += """ 
         JOIN users ON user_hash = logs.character_id AND faction <> 'Mob'
@@ -267,68 +340,103 @@ def summarize_logs_paginated(conn, faction_filter, location_filter, start_dateti
     else:
         query += """ 
         JOIN users ON user_hash = logs.character_id AND faction <> 'Mob' """
-    for filter in faction_filter:
-        if "*" in filter:
-            factions = ['East', 'West', 'Pirate']
-        else:
-            factions.append(filter)
-    if len(factions) > 0:
-        if len(factions) == 1:
-            filters.append(f"users.faction = '{factions[0]}'")
-        else:
-            filters.append(f"users.faction IN {tuple(factions)}")
-    for filter in location_filter:
-        if filter:
-            filters.append(f"location = '{filter}'")
-    if start_datetime:
-        filters.append(f"time >= '{start_datetime}'")
-    if end_datetime:
-        filters.append(f"time <= '{end_datetime}'")
-    if log_type:
-        filters.append(f"log_type = '{log_type}'")
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
-
-    offset = (page_number - 1) * page_size
-
-    query += f" GROUP BY logs.log_id, users.faction, logs.location, logs.log_type, logs.time, logs.character, logs.receiver ORDER BY logs.time DESC LIMIT {page_size} OFFSET {offset}"
-
-    cursor.execute(query)
+    filters = report_filter(faction_filter, location_filter, start_datetime, end_datetime, log_type)
+    direction = 'next'
+    if page_token:
+        direction, key_time, key_log_id = decode_page_token(page_token)
+        comparison = '<' if direction == 'next' else '>'
+        filters.add(f"(logs.time, logs.log_id) {comparison} (%s::timestamptz, %s::uuid)", key_time, key_log_id)
+    query += filters.sql()
+
+    order = 'DESC' if direction == 'next' else 'ASC'
+    # One row past the page tells whether there is a page after it
+    query += f" ORDER BY logs.time {order}, logs.log_id {order} LIMIT %s"
+
+    execute_prepared(cursor, query, filters.params + [int(page_size) + 1])
     data = cursor.fetchall()
+    has_more = len(data) > page_size
+    data = data[:page_size]
+    if direction == 'next':
+        prev_token = encode_page_token('prev', data[0]) if page_token and data else None
+        next_token = encode_page_token('next', data[-1]) if has_more else None
+    elif not has_more:
+        # Back at the newest logs, the first page is shown full
+        return summarize_logs_page(conn, faction_filter, location_filter, start_datetime, end_datetime, page_size,
+                                   log_type, only_pvp)
+    else:
+        data.reverse()
+        prev_token = encode_page_token('prev', data[0])
+        next_token = encode_page_token('next', data[-1])
     df = pd.DataFrame(data, columns=["Log ID", "Faction", "Location", "Log Type", "Time",  "Character",  "Target",  "Total"])
-    return df
+    return df, prev_token, next_token
+
+
+def encode_page_token(direction, row):
+    # Opaque to the page, holds the direction and the (time, log_id) key of the row to seek from
+    key = dict(direction=direction, time=row[4].isoformat(), log_id=str(row[0]))
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_page_token(page_token):
+    key = json.loads(base64.urlsafe_b64decode(page_token.encode()))
+    return key['direction'], key['time'], key['log_id']
 
 
-def paginate(page, page_size):
-    page = max(1, page) 
-    offset = (page - 1) * page_size
-    return page, offset
+def move_logs_page(state_key, page_token, step):
+    state = st.session_state[state_key]
+    state['token'] = page_token
+    state['page'] += step
 
 
+def render_logs_page(conn, state_key, sidebar_fields, start_datetime, end_datetime, log_type, only_pvp):
+    """
+    Renders a logs table paged with Prev and Next buttons, the page token is kept in the session under
+    state_key and reset to the first page when the filters or the page size change.
+    """
+    state = st.session_state.setdefault(state_key, dict(filters=None, token=None, page=1))
+    column_page_number, column_page_size, column_page_navigation = st.columns(3)
+    with column_page_size:
+        page_size = st.number_input("Page Size", 1, step=1, value=20, key=f"{state_key}_page_size")
+    filters = (tuple(sidebar_fields['faction_filter']), tuple(sidebar_fields['location_filter']), start_datetime,
+               end_datetime, page_size)
+    if state['filters'] != filters:
+        state.update(filters=filters, token=None, page=1)
+
+    table, prev_token, next_token = summarize_logs_page(
+        conn=conn, 
+        faction_filter=sidebar_fields['faction_filter'],
+        location_filter=sidebar_fields['location_filter'], 
+        start_datetime=start_datetime, 
+        end_datetime=end_datetime, 
+        page_size=page_size, 
+        log_type=log_type,
+        only_pvp=only_pvp,
+        page_token=state['token']
+    )
+    if prev_token is None:
+        state['page'] = 1
+    with column_page_number:
+        st.write(f"Page {state['page']}")
+    with column_page_navigation:
+        st.write('Paginated view of logs navigation:')
+        column_prev, column_next = st.columns(2)
+        with column_prev:
+            st.button('Prev', key=f"{state_key}_prev", disabled=prev_token is None,
+                      on_click=move_logs_page, args=(state_key, prev_token, -1))
+        with column_next:
+            st.button('Next', key=f"{state_key}_next", disabled=next_token is None,
+                      on_click=move_logs_page, args=(state_key, next_token, 1))
+    st.table(table)
+
+
+@cached_query
 def query_users_by_faction(conn, faction_filter, location_filter, start_datetime, end_datetime):
     cursor = conn.cursor()
-    query = "SELECT DISTINCT logs.character, logs.time FROM logs JOIN users ON logs.character_id = users.user_hash WHERE 1=1"
-    filters = []
-    faction = []
-    if "*" in faction_filter:
-        faction = ["East", "West", "Pirate"]
-    else:
-        for filter in faction_filter:
-            if filter in ["East", "West", "Pirate"]:
-                filters.append(faction)
-    if faction_filter and len(faction) > 0:
-        filters.append(f"users.faction IN {tuple(faction)}")
-    for filter in location_filter:
-        if filter:
-            filters.append(f"location = '{filter}'")
-    if start_datetime:
-        filters.append(f"time >= '{start_datetime}'")
-    if end_datetime:
-        filters.append(f"time <= '{end_datetime}'")
-    if filters:
-        query += " AND " + " AND ".join(filters)
-    query += " ORDER BY time"
-    cursor.execute(query)
+    query = "SELECT DISTINCT logs.character, logs.time FROM logs JOIN users ON logs.character_id = users.user_hash"
+    filters = report_filter(faction_filter, location_filter, start_datetime, end_datetime)
+    query += filters.sql()
+    query += " ORDER BY logs.time"
+    execute_prepared(cursor, query, filters.params)
     return cursor.fetchall()
 
 
@@ -349,36 +457,50 @@ def create_report_filter_sidebar(locations: List[str], faction=True):
     return filter_sidebar, sidebar_fields
 
 
-def get_top_users_by_faction(cursor, log_type, faction_filter, location_filter=[], start_datetime=None, end_datetime=None):
-    factions = []
-    if "*" in faction_filter:
-        factions = ['East', 'West', 'Pirate']
+@cached_query
+def get_top_users_by_faction(conn, log_type, faction_filter, location_filter=[], start_datetime=None, end_datetime=None,
+                             limit=TOP_USERS_LIMIT, from_rollup=True):
+    """
+    Ranks the users of every selected faction by their total in one query, keeping the top limit of each.
+    from_rollup reads the per character minute totals of log_rollup_character, otherwise the logs themselves,
+    exact to the second at the ends of the time range. Damage only counts damage done to players.
+    Returns {faction: [(user_name, log_count, total)]} in faction order.
+    """
+    factions = resolve_faction_filter(faction_filter)
+    if not factions:
+        return {}
+    cursor = conn.cursor()
+    if from_rollup:
+        query = """
+            SELECT users.faction, users.user_name, SUM(rollup.log_count), SUM(rollup.total),
+                   ROW_NUMBER() OVER (PARTITION BY users.faction ORDER BY SUM(rollup.total) DESC, users.user_name) AS rank
+            FROM log_rollup_character AS rollup
+            JOIN users ON users.user_hash = rollup.character_id"""
+        filters = report_filter(faction_filter, location_filter, start_datetime, end_datetime,
+                                location_column="rollup.location", time_column="rollup.bucket")
+        filters.add("rollup.log_type = %s", log_type)
+        if log_type == "Damage":
+            filters.add("rollup.receiver_faction <> 'Mob'")
     else:
-        factions.append(filter)
-    top_users_by_faction = {}
-    for faction in factions:
-        query = """SELECT users.user_name, COUNT(*), SUM(logs.total) as t FROM logs JOIN users ON logs.character_id = users.user_hash """
-        filters = [f"logs.log_type = '{log_type}'"]
+        query = """
+            SELECT users.faction, users.user_name, COUNT(*), SUM(logs.total),
+                   ROW_NUMBER() OVER (PARTITION BY users.faction ORDER BY SUM(logs.total) DESC, users.user_name) AS rank
+            FROM logs
+            JOIN users ON logs.character_id = users.user_hash"""
         if log_type == "Damage":
-           query += "JOIN users AS recv_users ON recv_users.user_hash = logs.receiver_id "
-           filters.append("recv_users.faction <> 'Mob'")
-        
-        filters.append(f"users.faction = '{faction}'")
-        if len(location_filter) > 0:
-            for location in location_filter:
-                if location:
-                    filters.append(f"logs.location = '{location}'")
-        if start_datetime:
-            filters.append(f"logs.time >= '{start_datetime}'")
-        if end_datetime:
-            filters.append(f"logs.time <= '{end_datetime}'")
-        if filters:
-            query += " WHERE " + " AND ".join(filters)
-        query += " GROUP BY users.user_name ORDER BY t DESC LIMIT 20"
-        cursor.execute(query)
-        top_users_by_faction[faction] = cursor.fetchall()
+            query += " JOIN users AS recv_users ON recv_users.user_hash = logs.receiver_id"
+        filters = report_filter(faction_filter, location_filter, start_datetime, end_datetime, log_type)
+        if log_type == "Damage":
+            filters.add("recv_users.faction <> 'Mob'")
+    query = "SELECT * FROM (" + query + filters.sql() + " GROUP BY users.faction, users.user_name) AS ranked"
+    query += " WHERE rank <= %s ORDER BY rank"
+    execute_prepared(cursor, query, filters.params + [int(limit)])
+    top_users_by_faction = {faction: [] for faction in factions}
+    for faction, user_name, log_count, total, _ in cursor.fetchall():
+        top_users_by_faction[faction].append((user_name, log_count, total))
     return top_users_by_faction
 
+@cached_query
 def get_users(conn):
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users")
@@ -388,8 +510,9 @@ def get_users(conn):
     return df_user
 
 
+@cached_query
 def get_users_filtered(conn, faction_filter, name_filter):
-    filters = []
+    filters = QueryFilter()
     factions = []
     empty_filter = False
     all_factions = False
@@ -402,25 +525,23 @@ def get_users_filtered(conn, faction_filter, name_filter):
         if "*" in faction_filter:
             all_factions = True
     cursor = conn.cursor()
-    query = "SELECT * FROM users WHERE 1=1"
+    query = "SELECT * FROM users"
     if name_filter != '':
-        filters.append(f"user_name = '{name_filter}'")
+        filters.add("user_name = %s", name_filter)
     elif len(factions) > 0 and not empty_filter and not all_factions:
-        if len(factions) == 1:
-            filters.append(f"faction = '{factions[0]}'")
-        elif len(factions) > 1:
-            filters.append(f"faction IN {tuple(factions)}")
+        filters.any_of("faction", factions)
     elif empty_filter is True:
-        filters.append("faction IS NULL")
-    if len(filters) > 0:
-        query += " AND " + " AND ".join(filters)
+        filters.add("faction IS NULL")
+    query += filters.sql()
+    if filters.conditions:
         query += " order by faction desc, user_name"
-    cursor.execute(query)
+    execute_prepared(cursor, query, filters.params)
     user_data = cursor.fetchall()
     df_user = pd.DataFrame(user_data, columns=[
                             "User Hash", "User Name", "Faction"])
     return df_user
 
+@cached_query
 def check_users_faction(conn):
     cursor = conn.cursor()
     cursor.execute(
@@ -456,167 +577,198 @@ def validate_users_in_factions(conn):
         if faction_info.get('mob') == 0 or faction_info.get('east') == 0 or faction_info.get('west') == 0 or faction_info.get('pirate') == 0:
             error_faction_modal()
 
-def convert_timezone(timestamp, from_tz, to_tz):
-    timestamp = timestamp.replace(tzinfo=None)
-    from_zone = pytz.timezone(from_tz)
-    to_zone = pytz.timezone(to_tz)
-    timestamp = from_zone.localize(timestamp).astimezone(to_zone)
-    return timestamp
-
-def parse_combat(log_file, start_time=None, end_time=None, target_name=None):
+def convert_log_times(times, log_timezone, db_timezone, state=None):
     """
-    Parses combat logs.
+    Converts naive log times from log_timezone to 'YYYY-MM-DD HH:MM:SS' strings in db_timezone at once.
+    Wall times repeated when DST ends are told apart by log order: logs are written chronologically, so an
+    ambiguous time is the first (DST) occurrence until the clock steps back. Times skipped when DST starts
+    are shifted forward. state carries the last time and ambiguous occurrence over consecutive batches.
     """
-    combat_logs = []
-    damage_regex = re.compile(r"<(?P<log_time_str>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?P<character>.*?)\|r attacked (?P<receiver>.*?)\|r using \|cff25fcff(.*?)\|r and caused \|cffff0000\-(?P<total>\d+)")
-    heal_regex = re.compile(r"<(?P<log_time_str>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?P<character>.*?)\|r targeted (?P<receiver>[^|]+)\|[^|]+\|cff25fcff(?P<ability>[^|]+)\|[^|]+\|cff00ff00(?P<restored>[^|]+)\|r health.")
-
-    #with open(log_file, "r", encoding="utf8") as file:
-    for line in log_file.splitlines():
-        try:
-            if "attacked" in line:
-                match_damage = damage_regex.search(line)
-                if match_damage:
-                    log_time_str, character, receiver, _, total = match_damage.groups()
-                    log_type = "Damage"
-                    timestamp = datetime.strptime(log_time_str, '%Y-%m-%d %H:%M:%S')
-                    combat_logs.append((log_type, timestamp, character.strip(), receiver.strip(), total.strip()))
-                    continue
-            
-            if "targeted" in line:
-                match_heal = heal_regex.search(line)
-                if match_heal:
-                    log_time_str, character, receiver, _, restored = match_heal.groups()
-                    log_type = "Heal"
-                    timestamp = datetime.strptime(log_time_str, '%Y-%m-%d %H:%M:%S')
-                    combat_logs.append((log_type, timestamp, character.strip(), receiver.strip(), restored.strip()))
-                    continue
-        except UnicodeDecodeError:
-            pass
-    
-    # Filter logs based on start_time, end_time, and target_name
-    if start_time:
-        combat_logs = [log for log in combat_logs if log[1] >= start_time]
-    if end_time:
-        combat_logs = [log for log in combat_logs if log[1] <= end_time]
-    if target_name:
-        combat_logs = [log for log in combat_logs if log[3] == target_name]
-
-    return combat_logs
-
-def parse_location(misc_log_file):
-    """
-    Parses location logs.
-    """
-    location_logs = {}
-    regex_enter = r"<(?P<log_timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})Entering Chat: \d+\.(?P<filter>Shout)\. (?P<log_location>[\w\s]+)"
-    regex_leave = r"<(?P<log_timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})Leaving Chat: \d+\.(?P<filter>Shout)\. (?P<log_location>[\w\s]+)"
-
-    #with open(misc_log_file, "r", encoding='ISO-8859-1') as file:
-    for line in misc_log_file.splitlines():
-        try:
-            if line.startswith('BackupNameAttachment'):
-                continue
-            match_enter = re.match(regex_enter, line)
-            if match_enter:
-                log_timestamp, _, log_location = match_enter.groups()
-                timestamp = datetime.strptime(log_timestamp, '%Y-%m-%d %H:%M:%S')
-                log_location = log_location.strip()  # Remove leading and trailing whitespace
-                if log_location in location_logs:
-                    location_logs[log_location]['enter'] = timestamp
-                else:
-                    location_logs[log_location] = {'enter': timestamp}
-                continue
-            
-            match_leave = re.match(regex_leave, line)
-            if match_leave:
-                log_timestamp, _, log_location = match_leave.groups()
-                timestamp = datetime.strptime(log_timestamp, '%Y-%m-%d %H:%M:%S')
-                log_location = log_location.strip()  # Remove leading and trailing whitespace
-                if log_location in location_logs:
-                    location_logs[log_location]['exit'] = timestamp
-                else:
-                    location_logs[log_location] = {'exit': timestamp}
-        except UnicodeDecodeError:
-            pass
-    return location_logs
-
-def merge_logs(combat_log_file, misc_log_file):
-    """
-    Merges combat and location logs.
-    """
-    location_logs = parse_location(misc_log_file)
-    combat_logs = parse_combat(combat_log_file)
-
-    merged_logs = []
-    for combat_log in combat_logs:
-        log_time = combat_log[1]
-        for location, times in location_logs.items():
-            if is_within_duration(log_time, times.get('enter'), times.get('exit')):
-                merged_logs.append(combat_log + (location,))
-                break
-
-    return merged_logs
-
+    if state is None:
+        state = {}
+    if not times:
+        return []
+    naive = pd.Series(pd.to_datetime(times))
+    ambiguous = naive.dt.tz_localize(log_timezone, ambiguous='NaT', nonexistent='shift_forward').isna()
+    step_back = naive.diff() < pd.Timedelta(0)
+    if state.get('last') is not None:
+        step_back.iloc[0] = naive.iloc[0] < state['last']
+    steps_back = step_back.cumsum()
+    runs = (ambiguous != ambiguous.shift(fill_value=False)).cumsum()
+    # An ambiguous time is DST while the clock hasn't stepped back since its run of ambiguous times began
+    is_dst = steps_back.eq((steps_back - step_back).groupby(runs).transform('first'))
+    if ambiguous.iloc[0] and state.get('ambiguous'):
+        # The first run continues the ambiguous run the previous batch ended in
+        is_dst &= (runs != runs.iloc[0]) | state['dst']
+    state['last'] = naive.iloc[-1]
+    state['ambiguous'] = bool(ambiguous.iloc[-1])
+    state['dst'] = bool(is_dst.iloc[-1])
+    localized = naive.dt.tz_localize(log_timezone, ambiguous=is_dst.to_numpy(), nonexistent='shift_forward')
+    # Log times are whole seconds, so the datetime64 string form is already 'YYYY-MM-DD HH:MM:SS'
+    return localized.dt.tz_convert(db_timezone).dt.tz_localize(None).astype(str).tolist()
 
 def insert_batch_user_data(conn, batch_users):
-    cursor = conn.cursor()
     try:
-        args_str = ','.join(cursor.mogrify("(%s,%s)", x).decode() for x in batch_users)
-        insert_query = "INSERT INTO users (user_hash, user_name) VALUES " + args_str + " ON CONFLICT (user_hash) DO NOTHING;"
-        cursor.execute(insert_query)
+        copy_users(conn, batch_users)
         conn.commit()
+        return True
     except psycopg2.Error as e:
         print("Error inserting batch user data:", e)
         conn.rollback()
+        return False
         
-def is_within_duration(log_time, enter_time, exit_time):
-    """
-    Checks if a log time falls within the duration of entry and exit time for a location.
-    """
-    if enter_time is None or exit_time is None:
+def insert_location_logs(conn, sessions):
+    location_rows = []
+    for location, enter_time, exit_time in sessions:
+        if exit_time is None or enter_time >= exit_time:
+            continue
+        location_hash = generate_hash(",".join([location, enter_time, exit_time]))
+        location_rows.append((location_hash, location, enter_time, exit_time))
+    if not location_rows:
+        return True
+    try:
+        copy_location_logs(conn, location_rows)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        print("Error inserting location logs:", e)
+        conn.rollback()
         return False
-    return enter_time <= log_time <= exit_time
 
 def insert_batch_log_data_single(conn, batch_logs):
-    cursor = conn.cursor()
     try:
-        args_str = ','.join(cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s)", x).decode() for x in batch_logs)
-        insert_query = "INSERT INTO logs (log_type, time, character, receiver, total, location, log_id, character_id, receiver_id) VALUES " + args_str + " ON CONFLICT (log_id) DO NOTHING;"
-        cursor.execute(insert_query)
+        copy_logs(conn, batch_logs)
         conn.commit()
+        return True
     except psycopg2.Error as e:
         print("Error inserting batch log data:", e)
         conn.rollback()
+        return False
+
+@st.cache_resource
+def get_import_queue():
+    """
+    Import job queue shared by every session of the Streamlit process.
+    """
+    return JobQueue()
 
-def import_logs(combat_log_file, misc_log_file, log_timezone, db_timezone, db_connection):
-    now = datetime.now()
-    st.write(f"> {now.strftime('%Y-%m-%d %H:%M:%S')} : importing logs.")
-    merged_logs = merge_logs(combat_log_file, misc_log_file)
 
-    # Initialize batches for user data and log data
-    batch_users = set()
-    batch_logs = []
+def build_import_rows(merged_logs, log_timezone, db_timezone, time_state):
+    """
+    Converts a batch of merged logs into logs table rows in the database timezone.
+    """
+    log_times = convert_log_times([merged_log[1] for merged_log in merged_logs], log_timezone, db_timezone, time_state)
+    rows = []
+    for merged_log, log_time in zip(merged_logs, log_times):
+        log = [merged_log[0], log_time, merged_log[2], merged_log[3], merged_log[4], merged_log[5]]
+        rows.append((log[0], log[1], log[2], log[3], int(log[4]), log[5], generate_hash(",".join(log)), generate_hash(log[2]), generate_hash(log[3])))
+    return rows
 
-    for l in merged_logs:
-        log = list(l)
-        log_time = convert_timezone(log[1], log_timezone, db_timezone)
-        log[1] = str(log_time.strftime('%Y-%m-%d %H:%M:%S'))
-        log_data = (log[0], log[1], log[2], log[3], int(log[4]), log[5], generate_hash(",".join(log)), generate_hash(log[2]), generate_hash(log[3]))
-        batch_logs.append(log_data)
-        batch_users.add((log_data[7], log_data[2]))  # Add user data to the batch_users set
 
+def import_logs(job, combat_log_path, misc_log_path, log_timezone, db_timezone, pool):
+    """
+    Streams spooled log uploads into the database, run as a background job of the import queue.
+    The files are decoded chunk by chunk and parsed line by line, rows are flushed every IMPORT_BATCH_SIZE
+    so memory stays bounded whatever the upload size, and the job reports rows and the Combat.log read so far.
+    The spooled files are removed once the job ends.
+    """
     try:
-        conn = connect_to_database()
-        with conn:
-            insert_batch_user_data(conn, batch_users)
-            insert_batch_log_data_single(conn, batch_logs)
-    except Exception as e:
-        st.error(f"Error importing logs: {e}")
-    else:
-        now = datetime.now()
-        st.write(f"> {now.strftime('%Y-%m-%d %H:%M:%S')} : finished.")
-        
+        with pool.connection() as db_connection, open(misc_log_path, "rb") as misc_log_file, \
+                open(combat_log_path, "rb") as combat_log_file:
+            job.update(message="Parsing Misc.log.")
+            sessions = parse_location(enumerate(iter_decoded_lines(misc_log_file)))
+            closed_sessions = [session for session in sessions if session[2] is not None]
+            location_sessions = list(zip(
+                [session[0] for session in closed_sessions],
+                convert_log_times([session[1] for session in closed_sessions], log_timezone, db_timezone),
+                convert_log_times([session[2] for session in closed_sessions], log_timezone, db_timezone)
+            ))
+
+            combat_size = max(os.path.getsize(combat_log_path), 1)
+            merged_logs = merge_logs(parse_combat(iter_decoded_lines(combat_log_file)), sessions)
+            job.update(message="Parsing Combat.log.")
+            imported_rows = 0
+            time_state = {}
+            for merged_batch in chunked(merged_logs, IMPORT_BATCH_SIZE):
+                batch_logs = build_import_rows(merged_batch, log_timezone, db_timezone, time_state)
+                batch_users = {(log_data[7], log_data[2]) for log_data in batch_logs}
+                if not (insert_batch_user_data(db_connection, batch_users) and insert_batch_log_data_single(db_connection, batch_logs)):
+                    raise RuntimeError(f"Error importing logs after {imported_rows:,} rows, see the server log.")
+                imported_rows += len(batch_logs)
+                job.update(rows=imported_rows, progress=combat_log_file.tell() / combat_size)
+            if not insert_location_logs(db_connection, location_sessions):
+                raise RuntimeError("Error importing location logs, see the server log.")
+            job.update(progress=1.0, message="Refreshing reports.")
+            invalidate_cached_queries(db_connection)
+            job.update(message="Finished.")
+    finally:
+        os.remove(combat_log_path)
+        os.remove(misc_log_path)
+
+
+def spool_upload(uploaded_file):
+    """
+    Copies an upload to a temporary file the import job reads, so the job doesn't depend on the
+    session's upload buffer. Returns the file path.
+    """
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="upload_", suffix=".log", delete=False) as spool:
+        shutil.copyfileobj(uploaded_file, spool)
+    return spool.name
+
+
+def render_import_jobs(queue, job_ids):
+    """
+    Shows the import jobs of the session and reruns the page every IMPORT_POLL_SECONDS while any of them
+    is still queued or running.
+    """
+    active = False
+    for job_id in job_ids:
+        job = queue.get(job_id)
+        if job is None:
+            continue
+        submitted = datetime.fromtimestamp(job.submitted_at).strftime('%Y-%m-%d %H:%M:%S')
+        st.write(f"**Import {job.id[:8]}** submitted at {submitted}: {job.status}.")
+        if job.status == FAILED:
+            st.error(job.error)
+            continue
+        st.progress(job.progress, text=f"{job.message} {job.rows:,} rows imported, {job.rows_per_second:,.0f} rows/s.")
+        active = active or not job.done
+    if active:
+        time.sleep(IMPORT_POLL_SECONDS)
+        st.rerun()
+
+
+def change_affects_report(change, log_types, locations):
+    """
+    Tells whether a data change notification touches a report reading log_types at locations, None meaning any.
+    """
+    if log_types is not None and change['log_types'] is not None and not log_types & set(change['log_types']):
+        return False
+    locations = {location for location in locations or [] if location}
+    if locations and change['locations'] is not None and not locations & set(change['locations']):
+        return False
+    return True
+
+
+def follow_data_changes(listener, log_types, locations):
+    """
+    Waits for a data change affecting the shown report and reruns the page with the new data.
+    The status line is rewritten every LIVE_POLL_SECONDS, which lets Streamlit stop the wait when a widget changes.
+    """
+    version = listener.version
+    status = st.sidebar.empty()
+    while True:
+        changes = listener.wait(version, LIVE_POLL_SECONDS)
+        status.caption(f"Live, waiting for new logs since {datetime.now().strftime('%H:%M:%S')}.")
+        if not changes:
+            continue
+        version = changes[-1]['version']
+        if any(change_affects_report(change, log_types, locations) for change in changes):
+            current_data_version.clear()
+            st.rerun()
+
+
 def calculate_user_faction_percentage(faction_counts):
     total_users = sum(faction_counts.values())
     faction_percentages = {}
@@ -638,8 +790,18 @@ def calculate_continuous_presence(group):
 
 
 def main():
-    conn = connect_to_database()
-    create_tables(conn)
+    with connect_to_database() as conn:
+        live_report = render_page(conn)
+    # Waits for changes without a connection, putconn ended the page's transaction and its locks
+    if live_report is not None:
+        follow_data_changes(get_data_change_listener(), *live_report)
+
+
+def render_page(conn):
+    """
+    Renders the selected page. Returns the (log types, locations) of a Logs report to follow live, or None.
+    """
+    ensure_tables()
     locations = get_locations(conn)
     page = option_menu(
         menu_title="",
@@ -720,23 +882,14 @@ def main():
                 'end_date'] else f"{sidebar_fields['end_date']} {sidebar_fields['end_time']}"
 
             cursor = conn.cursor()
-            filters = []
-            if len(sidebar_fields['location_filter']) > 0:
-                for location in sidebar_fields['location_filter']:
-                    if location:
-                        filters.append(f"logs.location = '{location}'")
-            if start_datetime:
-                filters.append(f"logs.time >= '{start_datetime}'")
-            if end_datetime:
-                filters.append(f"logs.time <= '{end_datetime}'")
-            filters.append("users.user_name <> ''")
+            filters = report_filter(None, sidebar_fields['location_filter'], start_datetime, end_datetime)
+            filters.add("users.user_name <> ''")
             if filters:
                 query = """
                     SELECT DISTINCT users.user_name, users.faction, logs.location
                     FROM users
-                    JOIN logs ON users.user_hash = logs.character_id OR users.user_hash = logs.receiver_id
-                    WHERE """ + " AND ".join(filters)
-                cursor.execute(query)
+                    JOIN logs ON users.user_hash = logs.character_id OR users.user_hash = logs.receiver_id""" + filters.sql()
+                execute_prepared(cursor, query, filters.params)
                 user_logs = cursor.fetchall()
                 user_logs_df = pd.DataFrame(
                     user_logs, columns=["User Name", "Faction", "Location"])
@@ -803,10 +956,10 @@ def main():
                 factions = ['East', 'West', 'Pirate']
             for faction in factions:
                 data = query_users_by_faction(
-                    conn, faction, sidebar_fields['location_filter'], start_datetime, end_datetime
+                    conn, [faction], sidebar_fields['location_filter'], start_datetime, end_datetime
                 )
                 for row in data:
-                    time = datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S')
+                    time = row[1]
                     if time in time_count:
                         if faction in time_count[time]:
                             time_count[time][faction] += 1
@@ -825,39 +978,24 @@ def main():
             location_filter = sidebar_fields['location_filter'] 
             start_datetime = f"{sidebar_fields['start_date']} {sidebar_fields['start_time']}" if sidebar_fields['start_date'] else None
             end_datetime = f"{sidebar_fields['end_date']} {sidebar_fields['end_time']}" if sidebar_fields['end_date'] else None
-            filters = []
-            if len(sidebar_fields['location_filter']) > 0:
-                for location in sidebar_fields['location_filter']:
-                    if location:
-                        filters.append(f"logs.location = '{location}'")
-            if start_datetime:
-                filters.append(f"enter >= '{start_datetime}'")
-            if end_datetime:
-                filters.append(f"exit <= '{end_datetime}'")
+            filters = QueryFilter().any_of("location", location_filter)
+            filters.at_least("enter", start_datetime)
+            filters.at_most("exit", end_datetime)
             sql_query ="""SELECT
                             location,
                             enter AS Start,
                             exit AS Finish
                         FROM
-                            location_logs WHERE 1=1 AND """ + " AND ".join(filters)
-            if location_filter:
-                location_filter_str = "','".join(location_filter)
-                sql_query += f" AND location IN ('{location_filter_str}')"
-            if start_datetime:
-                sql_query += f" AND enter >= '{start_datetime}'"
-            if end_datetime:
-                sql_query += f" AND exit <= '{end_datetime}'" 
+                            location_logs""" + filters.sql()
             sql_query +=""" 
-                        ORDER BY enter;"""
-            cursor.execute(sql_query)
+                        ORDER BY enter"""
+            execute_prepared(cursor, sql_query, filters.params)
             data = cursor.fetchall()
             if not data:
                 st.write('No logs for current filter.')
             else:
                 columns = ['location', 'Start', 'Finish']
                 df = pd.DataFrame(data, columns=columns)
-                df['Start'] = pd.to_datetime(df['Start'])
-                df['Finish'] = pd.to_datetime(df['Finish'])
                 df.sort_values(by=['Start', 'location'], inplace=True)
                 tasks = []
                 for location, group in df.groupby('location'):
@@ -891,16 +1029,16 @@ def main():
                     selected_location = selected_row['location']
                     selected_start = selected_row['Start']
                     selected_end = selected_row['Finish']
-                    query = f"""
+                    query = """
                         SELECT DISTINCT users.user_name, users.faction, logs.location
                         FROM users
                         JOIN logs ON users.user_hash = logs.character_id OR users.user_hash = logs.receiver_id
-                        WHERE logs.location = '{selected_location}'
-                        AND logs.time >= '{selected_start}'
-                        AND logs.time <= '{selected_end}'
+                        WHERE logs.location = %s
+                        AND logs.time >= %s
+                        AND logs.time <= %s
                         ORDER by 3,2,1
                     """
-                    cursor.execute(query)
+                    execute_prepared(cursor, query, [selected_location, selected_start, selected_end])
                     filtered_data = cursor.fetchall()
                     st.subheader("Logs by location")
                     with st.container():
@@ -918,187 +1056,59 @@ def main():
             'end_date'] else f"{sidebar_fields['end_date']} {sidebar_fields['end_time']}"
 
         report_option = st.selectbox('Select a report', ['Overview', 'Pvp damage', 'Heals', 'Pve damage',
-                                     'Top users by faction', 'Explorer'], index=0, placeholder="Choose an option", disabled=False)
+                                     'Top users by faction', 'Explorer', 'Archive'], index=0, placeholder="Choose an option", disabled=False)
+        live = st.sidebar.toggle("Live", help="Refresh the report as soon as the cron live import writes new logs.")
         if report_option == 'Overview':
-            logs_summary = summarize_logs(
+            totalizers = get_totalizers(
                 conn, 
                 sidebar_fields['faction_filter'],
                 sidebar_fields['location_filter'], 
                 start_datetime, 
-                end_datetime,
-                log_type_filter=None,
-                only_pvp=True
+                end_datetime
             )
-            totalizers = get_totalizers(logs_summary)
 
             st.write("## Totalizers")
             st.table(totalizers)
 
             st.write("## Logs")
-            column_page_number, column_page_size, column_page_navigation = st.columns(
-                3)
-            with column_page_number:
-                page = st.number_input("Page", 1, step=1, value=1)
-            with column_page_size:
-                page_size = st.number_input("Page Size", 1, step=1, value=20)
-            with column_page_navigation:
-                prev_page, _ = paginate(page - 1, page_size)
-                next_page, _ = paginate(page + 1, page_size)
-
-                st.write('Paginated view of logs navigation:')
-                column_prev, column_next = st.columns(2)
-                with column_prev:
-                    if st.button('Prev'):
-                        page, _ = paginate(page - 1, page_size)
-                with column_next:
-                    if st.button('Next'):
-                        page, _ = paginate(page + 1, page_size)
-
-            # Get logs for current page
-            logs_table = summarize_logs_paginated(
-                conn=conn, 
-                faction_filter=sidebar_fields['faction_filter'],
-                location_filter=sidebar_fields['location_filter'], 
-                start_datetime=start_datetime, 
-                end_datetime=end_datetime, 
-                page_number=page, 
-                page_size=page_size, 
-                log_type=None,
-                only_pvp=False
-            )
-            
-            st.table(logs_table)
+            render_logs_page(conn, 'overview_logs', sidebar_fields, start_datetime, end_datetime, log_type=None, only_pvp=False)
 
         elif report_option == "Pvp damage":
             st.write("### PVP Damage by Faction")
             st.write("Timechart")
-            dmg_df = summarize_logs_filtered(conn, sidebar_fields['faction_filter'],
-                                             sidebar_fields['location_filter'], start_datetime, end_datetime, 'Damage')
+            dmg_df = summarize_rollup_timechart(conn, sidebar_fields['faction_filter'],
+                                                sidebar_fields['location_filter'], start_datetime, end_datetime, 'Damage')
             if not dmg_df.empty:
-                dmg_df['Time'] = pd.to_datetime(dmg_df['Time'])
-                dmg_df = dmg_df.groupby(['Faction', pd.Grouper(key='Time')])[
-                    'Total'].sum().reset_index()
                 st.bar_chart(dmg_df, x='Time', y='Total',
                              color='Faction', use_container_width=True)
-                
-                column_page_number, column_page_size, column_page_navigation = st.columns(
-                3)
-                with column_page_number:
-                    page = st.number_input("Page", 1, step=1, value=1)
-                with column_page_size:
-                    page_size = st.number_input("Page Size", 1, step=1, value=20)
-                with column_page_navigation:
-                    prev_page, _ = paginate(page - 1, page_size)
-                    next_page, _ = paginate(page + 1, page_size)
-
-                    st.write('Paginated view of logs navigation:')
-                    column_prev, column_next = st.columns(2)
-                    with column_prev:
-                        if st.button('Prev'):
-                            page, _ = paginate(page - 1, page_size)
-                    with column_next:
-                        if st.button('Next'):
-                            page, _ = paginate(page + 1, page_size)
-                table = summarize_logs_paginated(
-                    conn=conn, 
-                    faction_filter=sidebar_fields['faction_filter'],
-                    location_filter=sidebar_fields['location_filter'], 
-                    start_datetime=start_datetime, 
-                    end_datetime=end_datetime, 
-                    page_number=page, 
-                    page_size=page_size, 
-                    log_type='Damage',
-                    only_pvp=True
-                )
-                st.table(table)
+
+                render_logs_page(conn, 'pvp_damage_logs', sidebar_fields, start_datetime, end_datetime, log_type='Damage',
+                                 only_pvp=True)
 
         elif report_option == "Heals":
             st.write("### Heal to Players by Faction")
             st.write("Timechart")
-            heal_df = summarize_logs_filtered(conn, sidebar_fields['faction_filter'],
-                                              sidebar_fields['location_filter'], start_datetime, end_datetime, 'Heal')
+            heal_df = summarize_rollup_timechart(conn, sidebar_fields['faction_filter'],
+                                                 sidebar_fields['location_filter'], start_datetime, end_datetime, 'Heal')
             if not heal_df.empty:
-                heal_df['Time'] = pd.to_datetime(
-                    heal_df['Time'])
-                heal_df = heal_df.groupby(['Faction', pd.Grouper(key='Time')])[
-                    'Total'].sum().reset_index()
                 st.bar_chart(heal_df, x='Time', y='Total',
                              color='Faction', use_container_width=True)
-                
-                column_page_number, column_page_size, column_page_navigation = st.columns(
-                3)
-                with column_page_number:
-                    page = st.number_input("Page", 1, step=1, value=1)
-                with column_page_size:
-                    page_size = st.number_input("Page Size", 1, step=1, value=20)
-                with column_page_navigation:
-                    prev_page, _ = paginate(page - 1, page_size)
-                    next_page, _ = paginate(page + 1, page_size)
-
-                    st.write('Paginated view of logs navigation:')
-                    column_prev, column_next = st.columns(2)
-                    with column_prev:
-                        if st.button('Prev'):
-                            page, _ = paginate(page - 1, page_size)
-                    with column_next:
-                        if st.button('Next'):
-                            page, _ = paginate(page + 1, page_size)
-                table = summarize_logs_paginated(
-                    conn=conn, 
-                    faction_filter=sidebar_fields['faction_filter'],
-                    location_filter=sidebar_fields['location_filter'], 
-                    start_datetime=start_datetime, 
-                    end_datetime=end_datetime, 
-                    page_number=page, 
-                    page_size=page_size, 
-                    log_type='Heal',
-                    only_pvp=True
-                )
-                st.table(table)
+
+                render_logs_page(conn, 'heal_logs', sidebar_fields, start_datetime, end_datetime, log_type='Heal',
+                                 only_pvp=True)
                 
         elif report_option == "Pve damage":
             st.write("### Pve Damage by Faction")
             st.write("Timechart")
-            pve_df = summarize_logs_filtered_on_mobs(
-                conn, sidebar_fields['faction_filter'], sidebar_fields['location_filter'], start_datetime, end_datetime, 'Damage')
+            pve_df = summarize_rollup_timechart(
+                conn, sidebar_fields['faction_filter'], sidebar_fields['location_filter'], start_datetime, end_datetime, 'Damage',
+                only_pvp=False)
             if not pve_df.empty:
-                pve_df['Time'] = pd.to_datetime(
-                    pve_df['Time'])
-                pve_df = pve_df.groupby(['Faction', pd.Grouper(key='Time')])[
-                    'Total'].sum().reset_index()
                 st.bar_chart(pve_df, x='Time', y='Total',
                              color='Faction', use_container_width=True)
-                
-                column_page_number, column_page_size, column_page_navigation = st.columns(
-                3)
-                with column_page_number:
-                    page = st.number_input("Page", 1, step=1, value=1)
-                with column_page_size:
-                    page_size = st.number_input("Page Size", 1, step=1, value=20)
-                with column_page_navigation:
-                    prev_page, _ = paginate(page - 1, page_size)
-                    next_page, _ = paginate(page + 1, page_size)
-
-                    st.write('Paginated view of logs navigation:')
-                    column_prev, column_next = st.columns(2)
-                    with column_prev:
-                        if st.button('Prev'):
-                            page, _ = paginate(page - 1, page_size)
-                    with column_next:
-                        if st.button('Next'):
-                            page, _ = paginate(page + 1, page_size)
-                table = summarize_logs_paginated(
-                    conn=conn, 
-                    faction_filter=sidebar_fields['faction_filter'],
-                    location_filter=sidebar_fields['location_filter'], 
-                    start_datetime=start_datetime, 
-                    end_datetime=end_datetime, 
-                    page_number=page, 
-                    page_size=page_size, 
-                    log_type='Damage',
-                    only_pvp=False
-                )
-                st.table(table)
+
+                render_logs_page(conn, 'pve_damage_logs', sidebar_fields, start_datetime, end_datetime, log_type='Damage',
+                                 only_pvp=False)
 
         elif report_option == "Top users by faction":
             st.title("Top users by faction")
@@ -1106,19 +1116,25 @@ def main():
             log_types = ['Heal', 'Damage']
             selected_log_type = st.selectbox(
                 "Select log type:", log_types, index=1)
+            column_limit, column_exact = st.columns(2)
+            with column_limit:
+                top_limit = st.number_input("Users per faction", 1, step=1, value=TOP_USERS_LIMIT)
+            with column_exact:
+                exact = st.checkbox("Exact time range", help="Reads the logs instead of the per minute totals, slower on long ranges.")
 
-            cursor = conn.cursor()
             top_users_by_faction = get_top_users_by_faction(
-                cursor,
+                conn,
                 selected_log_type,
                 sidebar_fields['faction_filter'],
                 sidebar_fields['location_filter'],
                 start_datetime,
-                end_datetime
+                end_datetime,
+                limit=top_limit,
+                from_rollup=not exact
             )
 
             for faction, top_users in top_users_by_faction.items():
-                st.subheader(f"Top 20 users of {faction}.")
+                st.subheader(f"Top {top_limit} users of {faction}.")
                 table_data = [(f"{i}. {user_name}", log_count, t)
                               for i, (user_name, log_count, t) in enumerate(top_users, 1)]
                 df_top_pvp = pd.DataFrame(
@@ -1135,6 +1151,26 @@ def main():
             if not df_merged.empty:
                 filtered_df = dataframe_explorer(df_merged, case=False)
                 st.dataframe(filtered_df, use_container_width=True)
+
+        elif report_option == "Archive":
+            st.write("### Archived logs by Faction")
+            column_log_type, column_pvp = st.columns(2)
+            with column_log_type:
+                archive_log_type = st.selectbox("Select log type:", ['Damage', 'Heal'], index=0)
+            with column_pvp:
+                archive_only_pvp = st.checkbox("Players only", value=True)
+            daily_df, location_df = summarize_archive(
+                sidebar_fields['faction_filter'], sidebar_fields['location_filter'], start_datetime, end_datetime,
+                archive_log_type, archive_only_pvp)
+            if daily_df.empty:
+                st.write("No archived logs for the selected filters.")
+            else:
+                st.bar_chart(daily_df, x='Time', y='Total', color='Faction', use_container_width=True)
+                st.table(location_df)
+
+        if live:
+            # Followed by main once the connection is back in the pool
+            return LIVE_REPORT_LOG_TYPES[report_option], sidebar_fields['location_filter']
                 
     elif page == "💾 Import":
         st.title("Log File Importer")
@@ -1146,15 +1182,15 @@ def main():
         timezones = [DEFAULT_TIMEZONE] + pytz.all_timezones
         log_timezone = st.selectbox("Select the timezone of the logs:", timezones, index=0)
 
+        queue = get_import_queue()
+        job_ids = st.session_state.setdefault('import_jobs', [])
         if st.button("Import Logs"):
             if combat_log_file is not None and misc_log_file is not None:
-                combat_file = StringIO(combat_log_file.getvalue().decode("ISO-8859-1"))
-                misc_file = StringIO(misc_log_file.getvalue().decode("ISO-8859-1"))
-                import_logs(combat_file.read(), misc_file.read(), log_timezone, DEFAULT_TIMEZONE, conn)
+                job_ids.append(queue.submit("import", import_logs, spool_upload(combat_log_file), spool_upload(misc_log_file),
+                                            log_timezone, DEFAULT_TIMEZONE, get_connection_pool()))
             else:
                 st.write("Please upload both Combat.log and Misc.log files.")
-    
-    conn.close()
+        render_import_jobs(queue, job_ids)
 
 
 if __name__ == "__main__":
@@ -13,34 +13,106 @@ ALTER ROLE adm CREATEDB;
 
 -- Create a table for users
 CREATE TABLE IF NOT EXISTS users (
-    user_hash TEXT PRIMARY KEY,
+    user_hash UUID PRIMARY KEY,
     user_name TEXT,
     faction TEXT
 );
 
--- Create a table for logs
+-- Create a table for logs, partitioned by week on time.
+-- Partitions (logs_YYYYMMDD, starting on Mondays) are created by the importers as rows arrive
+-- and ahead of time by the cron runner, which also detaches the ones past the retention period.
 CREATE TABLE IF NOT EXISTS logs (
     log_type TEXT,
-    time TEXT,
+    time TIMESTAMPTZ NOT NULL,
     character TEXT,
     receiver TEXT,
     total INTEGER,
     location TEXT,
-    log_id TEXT PRIMARY KEY,
-    character_id TEXT,
-    receiver_id TEXT
-);
+    log_id UUID,
+    character_id UUID,
+    receiver_id UUID,
+    PRIMARY KEY (log_id, time)
+) PARTITION BY RANGE (time);
 
 CREATE TABLE IF NOT EXISTS location_logs (
-    location_hash TEXT PRIMARY KEY,
+    location_hash UUID PRIMARY KEY,
+    location TEXT,
+    enter TIMESTAMPTZ,
+    exit TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS log_offsets (
+    file_path TEXT PRIMARY KEY,
+    inode BIGINT,
+    size BIGINT,
+    byte_offset BIGINT,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS data_version (
+    id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL,
+    updated_at TEXT
+);
+
+-- Rows of the live import that import_logs has not settled yet
+CREATE TABLE IF NOT EXISTS live_logs (
+    log_id UUID,
+    time TIMESTAMPTZ,
+    PRIMARY KEY (log_id, time)
+);
+
+-- Report rollups, refreshed by the importers for the minutes marked in log_rollup_dirty
+CREATE TABLE IF NOT EXISTS log_rollup_dirty (
+    bucket TIMESTAMPTZ PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS log_rollup_character (
+    bucket TIMESTAMPTZ NOT NULL,
+    location TEXT,
+    log_type TEXT,
+    character_id UUID,
+    receiver_faction TEXT,
+    total BIGINT,
+    log_count BIGINT
+);
+
+CREATE TABLE IF NOT EXISTS log_rollup_minute (
+    bucket TIMESTAMPTZ NOT NULL,
     location TEXT,
-    enter TEXT,
-    exit TEXT
+    log_type TEXT,
+    faction TEXT,
+    receiver_faction TEXT,
+    total BIGINT,
+    log_count BIGINT
 );
 
+-- Marks the minutes of a user's logs dirty when the user's faction changes
+CREATE OR REPLACE FUNCTION mark_user_rollups_dirty() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO log_rollup_dirty (bucket)
+    SELECT DISTINCT date_trunc('minute', time) FROM logs
+    WHERE character_id = NEW.user_hash OR receiver_id = NEW.user_hash
+    ON CONFLICT (bucket) DO UPDATE SET bucket = EXCLUDED.bucket;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_faction_insert_rollups ON users;
+CREATE TRIGGER users_faction_insert_rollups AFTER INSERT ON users
+    FOR EACH ROW WHEN (NEW.faction IS NOT NULL) EXECUTE FUNCTION mark_user_rollups_dirty();
+
+DROP TRIGGER IF EXISTS users_faction_update_rollups ON users;
+CREATE TRIGGER users_faction_update_rollups AFTER UPDATE OF faction ON users
+    FOR EACH ROW WHEN (OLD.faction IS DISTINCT FROM NEW.faction) EXECUTE FUNCTION mark_user_rollups_dirty();
+
 -- Create indexes
 CREATE UNIQUE INDEX IF NOT EXISTS idx_users_user_hash ON users (user_hash);
 CREATE INDEX IF NOT EXISTS idx_logs_character_id ON logs (character_id);
 CREATE INDEX IF NOT EXISTS idx_logs_receiver_id ON logs (receiver_id);
 CREATE INDEX IF NOT EXISTS idx_logs_log_type ON logs (log_type);
-CREATE INDEX IF NOT EXISTS idx_logs_time ON logs (time);
+CREATE INDEX IF NOT EXISTS idx_logs_time_log_id ON logs (time, log_id);
+CREATE INDEX IF NOT EXISTS idx_logs_location_time ON logs (location, time);
+CREATE INDEX IF NOT EXISTS idx_location_logs_enter ON location_logs (enter);
+CREATE INDEX IF NOT EXISTS idx_log_rollup_character_bucket ON log_rollup_character (bucket);
+CREATE INDEX IF NOT EXISTS idx_log_rollup_minute_bucket ON log_rollup_minute (bucket);
@@ -0,0 +1,3 @@
+"""
+Shared code used by the Streamlit front (front.py) and the cron importer (cron/cron.py).
+"""
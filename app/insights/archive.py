@@ -0,0 +1,194 @@
+"""
+Columnar archive of cold logs as Parquet files, one directory per partition week.
+
+Weeks detached from the logs table are written under LOG_ARCHIVE_DIR/week=YYYY-MM-DD/ with the
+character and receiver factions they had when archived. Names, locations, log types and factions are
+dictionary encoded, ids are stored as 16 bytes. Reads prune weeks by directory and row groups by their
+time statistics, and only load the columns asked for.
+"""
+import os
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from insights.db import DATABASE_TIMEZONE
+from insights.partitions import PARTITION_INTERVAL
+
+LOG_ARCHIVE_DIR = os.environ.get("LOG_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "archive"))
+ARCHIVE_FETCH_ROWS = 100000  # rows read from PostgreSQL and written as one row group at a time
+ARCHIVE_COMPRESSION = "zstd"
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("log_type", pa.dictionary(pa.int8(), pa.string())),
+    ("time", pa.timestamp("us", tz="UTC")),
+    ("character", pa.dictionary(pa.int32(), pa.string())),
+    ("receiver", pa.dictionary(pa.int32(), pa.string())),
+    ("total", pa.int32()),
+    ("location", pa.dictionary(pa.int32(), pa.string())),
+    ("character_faction", pa.dictionary(pa.int8(), pa.string())),
+    ("receiver_faction", pa.dictionary(pa.int8(), pa.string())),
+    ("log_id", pa.binary(16)),
+    ("character_id", pa.binary(16)),
+    ("receiver_id", pa.binary(16)),
+])
+WEEK_PARTITIONING = ds.partitioning(pa.schema([("week", pa.date32())]), flavor="hive")
+
+
+def archive_table_week(table_name):
+    """
+    Returns the week a logs_archive_YYYYMMDD table holds, or None for other names.
+    """
+    try:
+        return datetime.strptime(table_name, "logs_archive_%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def archive_week_path(week, directory=LOG_ARCHIVE_DIR, file_name="logs.parquet"):
+    return os.path.join(directory, f"week={week.isoformat()}", file_name)
+
+
+def archive_tables(conn):
+    """
+    Returns the names of the logs_archive_YYYYMMDD tables.
+    """
+    cursor = conn.cursor()
+    cursor.execute(r"SELECT tablename FROM pg_tables WHERE tablename LIKE 'logs\_archive\_%'")
+    return sorted(row[0] for row in cursor.fetchall() if archive_table_week(row[0]) is not None)
+
+
+def _record_batch(rows):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(ARCHIVE_SCHEMA, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode().cast(field.type))
+        elif pa.types.is_fixed_size_binary(field.type):
+            arrays.append(pa.array([bytes(value) if value is not None else None for value in values], field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=ARCHIVE_SCHEMA)
+
+
+def export_archive_table(conn, table_name, directory=LOG_ARCHIVE_DIR, file_name="logs.parquet"):
+    """
+    Writes an archive table to a Parquet file in the directory of its week, replacing a previous file of that name.
+    The rows are streamed through a named cursor, the file only appears once complete.
+    Returns the number of rows written.
+    """
+    week = archive_table_week(table_name)
+    path = archive_week_path(week, directory, file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = os.path.join(os.path.dirname(path), "_logs.parquet.partial")  # "_" files are skipped by readers
+    rows_written = 0
+    with conn.cursor(name=f"export_{table_name}") as cursor:
+        cursor.itersize = ARCHIVE_FETCH_ROWS
+        cursor.execute(f"""
+            SELECT archive.log_type, archive.time AT TIME ZONE 'UTC', archive.character, archive.receiver, archive.total,
+                   archive.location, users.faction, recv_users.faction,
+                   uuid_send(archive.log_id::uuid), uuid_send(archive.character_id::uuid), uuid_send(archive.receiver_id::uuid)
+            FROM {table_name} AS archive
+            LEFT JOIN users ON users.user_hash = archive.character_id::uuid
+            LEFT JOIN users AS recv_users ON recv_users.user_hash = archive.receiver_id::uuid
+            ORDER BY archive.time
+        """)
+        with pq.ParquetWriter(partial_path, ARCHIVE_SCHEMA, compression=ARCHIVE_COMPRESSION) as writer:
+            while True:
+                rows = cursor.fetchmany(ARCHIVE_FETCH_ROWS)
+                if not rows:
+                    break
+                writer.write_batch(_record_batch(rows))
+                rows_written += len(rows)
+    conn.commit()
+    os.replace(partial_path, path)
+    return rows_written
+
+
+def merge_archive_table(conn, table_name, directory=LOG_ARCHIVE_DIR):
+    """
+    Merges an archive table into the Parquet file of its week, skipping the log ids the week already holds.
+    The week is rewritten as a single logs.parquet file, the rows of a week fit in memory.
+    Returns the number of rows added.
+    """
+    week = archive_table_week(table_name)
+    path = archive_week_path(week, directory)
+    week_directory = os.path.dirname(path)
+    pending_path = os.path.join(week_directory, "_pending.parquet")
+    export_archive_table(conn, table_name, directory, "_pending.parquet")
+    existing_paths = [os.path.join(week_directory, file_name) for file_name in os.listdir(week_directory)
+                      if file_name.endswith(".parquet") and not file_name.startswith("_")]
+    existing = ds.dataset(existing_paths, format="parquet", schema=ARCHIVE_SCHEMA).to_table()
+    added = pq.read_table(pending_path, schema=ARCHIVE_SCHEMA)
+    added = added.filter(pc.invert(pc.is_in(added["log_id"], value_set=existing["log_id"])))
+    merged = pa.concat_tables([existing, added]).sort_by("time")
+    partial_path = os.path.join(week_directory, "_logs.parquet.partial")
+    pq.write_table(merged, partial_path, row_group_size=ARCHIVE_FETCH_ROWS, compression=ARCHIVE_COMPRESSION)
+    os.replace(partial_path, path)
+    for stale_path in existing_paths:
+        if stale_path != path:
+            os.remove(stale_path)
+    os.remove(pending_path)
+    return added.num_rows
+
+
+def export_pending_archives(conn, table_names=(), directory=LOG_ARCHIVE_DIR, keep_existing=False):
+    """
+    Exports the given archive tables and every archive table without a Parquet file yet.
+    A table normally replaces the file of its week. With keep_existing, for tables dropped once exported,
+    it is merged into it instead, since it then only holds the rows archived since.
+    Returns {table name: rows written}.
+    """
+    pending = set(table_names)
+    pending.update(name for name in archive_tables(conn) if not os.path.exists(archive_week_path(archive_table_week(name), directory)))
+    exported = {}
+    for name in sorted(pending):
+        if keep_existing and os.path.exists(archive_week_path(archive_table_week(name), directory)):
+            exported[name] = merge_archive_table(conn, name, directory)
+        else:
+            exported[name] = export_archive_table(conn, name, directory)
+    return exported
+
+
+def read_log_archive(columns, start=None, end=None, factions=None, locations=None, log_type=None, receiver_factions=None,
+                     directory=LOG_ARCHIVE_DIR):
+    """
+    Reads the archived logs between the UTC datetimes start and end into a pyarrow Table of the given columns.
+    Weeks outside [start, end] are not opened and row groups are skipped by their time statistics.
+    factions filters on the character faction, empty filters are ignored.
+    """
+    if not os.path.isdir(directory):
+        return ARCHIVE_SCHEMA.empty_table().select(columns)
+    dataset = ds.dataset(directory, format="parquet", schema=ARCHIVE_SCHEMA.append(pa.field("week", pa.date32())),
+                         partitioning=WEEK_PARTITIONING)
+    conditions = []
+    if start is not None:
+        conditions.append(ds.field("week") > pa.scalar(_to_date(start) - PARTITION_INTERVAL, pa.date32()))
+        conditions.append(ds.field("time") >= pa.scalar(start, pa.timestamp("us", tz="UTC")))
+    if end is not None:
+        conditions.append(ds.field("week") <= pa.scalar(_to_date(end), pa.date32()))
+        conditions.append(ds.field("time") <= pa.scalar(end, pa.timestamp("us", tz="UTC")))
+    if factions:
+        conditions.append(ds.field("character_faction").isin(list(factions)))
+    if receiver_factions:
+        conditions.append(ds.field("receiver_faction").isin(list(receiver_factions)))
+    if locations:
+        conditions.append(ds.field("location").isin(list(locations)))
+    if log_type:
+        conditions.append(ds.field("log_type") == log_type)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=list(columns), filter=expression)
+
+
+def _to_date(moment):
+    # Weeks start on a Monday in the database timezone, the UTC date of a late evening is a day ahead
+    if not isinstance(moment, datetime):
+        return moment
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(ZoneInfo(DATABASE_TIMEZONE)).date()
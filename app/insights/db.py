@@ -0,0 +1,220 @@
+"""
+Pooled PostgreSQL connections shared by the front and the cron runner.
+"""
+import json
+import os
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+
+DATABASE_TIMEZONE = "America/Sao_Paulo"  # naive log times are written and read in this zone
+DATABASE = dict(
+    dbname="user_logs",
+    user="adm",
+    password="supersecret",
+    port="5432",
+    options=f"-c timezone={DATABASE_TIMEZONE}"
+)
+POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 1))
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DATA_CHANNEL = "data_version"  # NOTIFY channel of data version bumps
+LISTEN_RETRY_SECONDS = 5  # seconds before a lost listener connection is reopened
+LISTEN_HISTORY = 100  # latest changes kept for waiters that fell behind
+CHECKOUT_TIMEOUT = 30  # seconds to wait for a free connection when the pool is exhausted
+HEALTH_CHECK_INTERVAL = 30  # seconds a connection may sit idle before it is pinged on checkout
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of psycopg2 connections.
+    Checkouts block while all maxconn connections are in use, idle connections are pinged before
+    being handed out and broken ones are replaced.
+    """
+
+    def __init__(self, host, minconn=POOL_MIN_SIZE, maxconn=POOL_MAX_SIZE, **connect_kwargs):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, host=host, **{**DATABASE, **connect_kwargs})
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+
+    def getconn(self):
+        """
+        Checks out a healthy connection, give it back with putconn.
+        """
+        if not self._slots.acquire(timeout=CHECKOUT_TIMEOUT):
+            raise pool.PoolError("timed out waiting for a database connection")
+        try:
+            while True:
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        """
+        Returns a connection to the pool, rolling back any transaction left open.
+        """
+        try:
+            if conn.closed:
+                self._discard(conn)
+                return
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn)
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context managed checkout: with db_pool.connection() as conn: ...
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        self._pool.closeall()
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host, **kwargs):
+    """
+    Returns the process wide pool for a database host, creating it on first use.
+    """
+    with _pools_lock:
+        if host not in _pools:
+            _pools[host] = ConnectionPool(host, **kwargs)
+        return _pools[host]
+
+
+def get_data_version(conn):
+    """
+    Returns the data version stamp, bumped after every committed write to the report tables.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT version FROM data_version WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def bump_data_version(conn, log_types=None, locations=None):
+    """
+    Bumps the data version stamp so cached report queries are invalidated. The caller commits.
+    Listeners of DATA_CHANNEL are notified on commit with the new version and, when known, the log
+    types and locations that changed. Returns the new version.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO data_version (id, version, updated_at) VALUES (1, 1, now()::TEXT)
+        ON CONFLICT (id) DO UPDATE SET version = data_version.version + 1, updated_at = EXCLUDED.updated_at
+        RETURNING version
+    """)
+    version = cursor.fetchone()[0]
+    change = dict(
+        version=version,
+        log_types=sorted(log_types) if log_types is not None else None,
+        locations=sorted(locations) if locations is not None else None,
+    )
+    cursor.execute("SELECT pg_notify(%s, %s)", (DATA_CHANNEL, json.dumps(change)))
+    return version
+
+
+class DataChangeListener:
+    """
+    Follows DATA_CHANNEL on a dedicated connection from a daemon thread and keeps the latest change.
+    Each change is a dict of version, log_types and locations, None meaning any.
+    """
+
+    def __init__(self, host, **connect_kwargs):
+        self._connect_kwargs = dict(host=host, **{**DATABASE, **connect_kwargs})
+        self._changed = threading.Condition()
+        self._changes = []
+        self.version = 0
+        threading.Thread(target=self._listen, name="data-change-listener", daemon=True).start()
+
+    def wait(self, after_version, timeout):
+        """
+        Waits up to timeout seconds for changes newer than after_version and returns them, oldest first.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > after_version, timeout)
+            return [change for change in self._changes if change['version'] > after_version]
+
+    def _listen(self):
+        while True:
+            try:
+                conn = psycopg2.connect(**self._connect_kwargs)
+                try:
+                    conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                    conn.cursor().execute(f"LISTEN {DATA_CHANNEL}")
+                    while True:
+                        if select.select([conn], [], [], HEALTH_CHECK_INTERVAL) == ([], [], []):
+                            continue
+                        conn.poll()
+                        while conn.notifies:
+                            self._publish(json.loads(conn.notifies.pop(0).payload))
+                finally:
+                    conn.close()
+            except (psycopg2.Error, OSError, ValueError) as e:
+                print("Data change listener lost its connection:", e, flush=True)
+                time.sleep(LISTEN_RETRY_SECONDS)
+
+    def _publish(self, change):
+        with self._changed:
+            self._changes = self._changes[-LISTEN_HISTORY + 1:] + [change]
+            self.version = max(self.version, change['version'])
+            self._changed.notify_all()
+
+
+def try_advisory_lock(conn, name):
+    """
+    Takes the session level advisory lock named name without waiting, returns whether it was taken.
+    The lock is held by the connection until advisory_unlock or until it is closed.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (name,))
+    locked = cursor.fetchone()[0]
+    conn.commit()
+    return locked
+
+
+def advisory_unlock(conn, name):
+    """
+    Releases a lock taken with try_advisory_lock.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (name,))
+    conn.commit()
@@ -0,0 +1,100 @@
+"""
+Background job queue for work that must not run inside a Streamlit script run, like log imports.
+
+Jobs run on a thread pool shared by every session of the process. Each job gets an id the pages
+poll for its status, progress, throughput and error.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("IMPORT_WORKERS", 2))
+JOB_RETENTION = 3600  # seconds a finished job stays queryable
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+
+class Job:
+    """
+    State of a submitted job. The running function reports through update().
+    """
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = QUEUED
+        self.rows = 0
+        self.progress = 0.0
+        self.message = ""
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def update(self, rows=None, progress=None, message=None):
+        if rows is not None:
+            self.rows = rows
+        if progress is not None:
+            self.progress = min(max(progress, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    @property
+    def done(self):
+        return self.status in (FINISHED, FAILED)
+
+    @property
+    def rows_per_second(self):
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+
+class JobQueue:
+    """
+    Runs submitted functions on a bounded thread pool, jobs past the pool size wait queued.
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, func, *args, **kwargs):
+        """
+        Queues func(job, *args, **kwargs) and returns the job id.
+        """
+        job = Job(name)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, func, args, kwargs):
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            func(job, *args, **kwargs)
+            job.status = FINISHED
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        expired = time.time() - JOB_RETENTION
+        for job_id, job in list(self._jobs.items()):
+            if job.done and job.finished_at < expired:
+                del self._jobs[job_id]
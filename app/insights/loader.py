@@ -0,0 +1,130 @@
+"""
+Bulk loading through PostgreSQL COPY.
+"""
+from insights.partitions import ensure_log_partitions, retention_cutoff
+from insights.rollups import mark_staged_rollups_dirty
+
+
+def format_copy_value(value):
+    """
+    Formats a value for the COPY text format.
+    """
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def format_copy_row(row):
+    """
+    Formats a row as one COPY text format line.
+    """
+    return "\t".join(format_copy_value(value) for value in row) + "\n"
+
+
+class CopyStream:
+    """
+    File-like object feeding rows to COPY FROM STDIN without building the whole payload in memory.
+    """
+
+    def __init__(self, rows):
+        self._lines = (format_copy_row(row) for row in rows)
+        self._buffer = ""
+
+    def read(self, size=-1):
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            parts.append(line)
+            length += len(line)
+        data = "".join(parts)
+        if size < 0 or length <= size:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_insert(conn, table, columns, rows, conflict_column, before_merge=None):
+    """
+    Streams rows through COPY into a temporary staging table and merges them into table
+    with one INSERT ... SELECT ... ON CONFLICT DO NOTHING. Returns the number of rows inserted.
+    before_merge, if given, is called with (conn, staging table name) once the rows are staged.
+    The caller commits.
+    """
+    staging = f"{table}_staging"
+    column_list = ", ".join(columns)
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS)")
+    cursor.execute(f"TRUNCATE {staging}")
+    cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN", CopyStream(rows))
+    if before_merge is not None:
+        before_merge(conn, staging)
+    cursor.execute(f"""
+        INSERT INTO {table} ({column_list})
+        SELECT {column_list} FROM {staging}
+        ON CONFLICT ({conflict_column}) DO NOTHING
+    """)
+    inserted = cursor.rowcount
+    cursor.execute(f"TRUNCATE {staging}")
+    return inserted
+
+
+def chunked(rows, size):
+    """
+    Groups an iterable into lists of at most size items.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+LOG_COLUMNS = ("log_type", "time", "character", "receiver", "total", "location", "log_id", "character_id", "receiver_id")
+USER_COLUMNS = ("user_hash", "user_name")
+LOCATION_COLUMNS = ("location_hash", "location", "enter", "exit")
+
+
+def prepare_staged_logs(conn, staging):
+    """
+    Drops the staged rows of archived weeks, so their partitions are not created again, then creates
+    the weekly partitions of logs the staged rows fall into and marks their minutes for the next
+    rollup refresh.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM {staging} WHERE time < %s", (retention_cutoff().isoformat(),))
+    cursor.execute(f"SELECT DISTINCT date_trunc('week', time)::date FROM {staging}")
+    ensure_log_partitions(conn, [row[0] for row in cursor.fetchall()])
+    mark_staged_rollups_dirty(conn, staging)
+
+
+def copy_logs(conn, log_rows, before_merge=None):
+    """
+    Bulk loads rows of the logs table, creating the partitions they need.
+    before_merge(conn, staging) then runs on the staged rows, before they are merged.
+    """
+    def prepare(conn, staging):
+        prepare_staged_logs(conn, staging)
+        if before_merge is not None:
+            before_merge(conn, staging)
+    return copy_insert(conn, "logs", LOG_COLUMNS, log_rows, "log_id, time", prepare)
+
+
+def copy_users(conn, user_rows):
+    """
+    Bulk loads (user_hash, user_name) rows of the users table.
+    """
+    return copy_insert(conn, "users", USER_COLUMNS, user_rows, "user_hash")
+
+
+def copy_location_logs(conn, location_rows):
+    """
+    Bulk loads rows of the location_logs table.
+    """
+    return copy_insert(conn, "location_logs", LOCATION_COLUMNS, location_rows, "location_hash")
@@ -0,0 +1,165 @@
+"""
+Schema migrations for databases created before a schema change.
+
+Run from the app directory:
+
+    python -m insights.migrate --host localhost
+
+Every migration runs once, in order, in its own transaction and is recorded in schema_migrations.
+Migrations are written to be no-ops on databases already created with the current schema.
+"""
+import argparse
+
+import psycopg2
+
+from insights.db import DATABASE, DATABASE_TIMEZONE
+from insights.rollups import MARK_USER_ROLLUPS_DIRTY_DDL, ROLLUP_DDL
+
+MIGRATIONS = [
+    ("0001_typed_timestamps", f"""
+        DO $$
+        BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'logs' AND column_name = 'time') = 'text' THEN
+                ALTER TABLE logs ALTER COLUMN time TYPE TIMESTAMPTZ
+                    USING NULLIF(time, '')::TIMESTAMP AT TIME ZONE '{DATABASE_TIMEZONE}';
+            END IF;
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'location_logs' AND column_name = 'enter') = 'text' THEN
+                ALTER TABLE location_logs
+                    ALTER COLUMN enter TYPE TIMESTAMPTZ USING NULLIF(enter, '')::TIMESTAMP AT TIME ZONE '{DATABASE_TIMEZONE}',
+                    ALTER COLUMN exit TYPE TIMESTAMPTZ USING NULLIF(exit, '')::TIMESTAMP AT TIME ZONE '{DATABASE_TIMEZONE}';
+            END IF;
+        END $$;
+        CREATE INDEX IF NOT EXISTS idx_logs_time ON logs (time);
+        CREATE INDEX IF NOT EXISTS idx_logs_location_time ON logs (location, time);
+        CREATE INDEX IF NOT EXISTS idx_location_logs_enter ON location_logs (enter);
+        ANALYZE logs;
+        ANALYZE location_logs;
+    """),
+    ("0002_partition_logs", """
+        DO $$
+        DECLARE
+            week DATE;
+            last_week DATE;
+        BEGIN
+            IF (SELECT relkind FROM pg_class WHERE oid = 'logs'::regclass) = 'r' THEN
+                ALTER TABLE logs RENAME TO logs_unpartitioned;
+                ALTER TABLE logs_unpartitioned RENAME CONSTRAINT logs_pkey TO logs_unpartitioned_pkey;
+                CREATE TABLE logs (
+                    log_type TEXT,
+                    time TIMESTAMPTZ NOT NULL,
+                    character TEXT,
+                    receiver TEXT,
+                    total INTEGER,
+                    location TEXT,
+                    log_id TEXT,
+                    character_id TEXT,
+                    receiver_id TEXT,
+                    PRIMARY KEY (log_id, time)
+                ) PARTITION BY RANGE (time);
+                SELECT date_trunc('week', min(time))::date, date_trunc('week', max(time))::date
+                    INTO week, last_week FROM logs_unpartitioned;
+                WHILE week <= last_week LOOP
+                    EXECUTE format('CREATE TABLE %I PARTITION OF logs FOR VALUES FROM (%L) TO (%L)',
+                                   'logs_' || to_char(week, 'YYYYMMDD'), week, week + 7);
+                    week := week + 7;
+                END LOOP;
+                INSERT INTO logs SELECT * FROM logs_unpartitioned WHERE time IS NOT NULL
+                    ON CONFLICT DO NOTHING;
+                DROP TABLE logs_unpartitioned;
+            END IF;
+        END $$;
+        CREATE INDEX IF NOT EXISTS idx_logs_character_id ON logs (character_id);
+        CREATE INDEX IF NOT EXISTS idx_logs_receiver_id ON logs (receiver_id);
+        CREATE INDEX IF NOT EXISTS idx_logs_log_type ON logs (log_type);
+        CREATE INDEX IF NOT EXISTS idx_logs_time ON logs (time);
+        CREATE INDEX IF NOT EXISTS idx_logs_location_time ON logs (location, time);
+        ANALYZE logs;
+    """),
+    ("0003_log_rollups", ";\n".join(ROLLUP_DDL) + """;
+        INSERT INTO log_rollup_dirty (bucket)
+        SELECT DISTINCT date_trunc('minute', time) FROM logs
+        ON CONFLICT DO NOTHING;
+    """),
+    ("0004_uuid_keys", """
+        DO $$
+        DECLARE
+            key_column RECORD;
+        BEGIN
+            FOR key_column IN SELECT * FROM (VALUES
+                    ('users', 'user_hash'), ('location_logs', 'location_hash'), ('logs', 'log_id'),
+                    ('logs', 'character_id'), ('logs', 'receiver_id'), ('log_rollup_character', 'character_id')
+                ) AS keys (table_name, column_name) LOOP
+                IF (SELECT data_type FROM information_schema.columns
+                    WHERE table_name = key_column.table_name AND column_name = key_column.column_name) = 'text' THEN
+                    EXECUTE format('ALTER TABLE %I ALTER COLUMN %I TYPE UUID USING %I::uuid',
+                                   key_column.table_name, key_column.column_name, key_column.column_name);
+                END IF;
+            END LOOP;
+        END $$;
+        ANALYZE users;
+        ANALYZE location_logs;
+        ANALYZE logs;
+    """),
+    ("0005_logs_keyset_index", """
+        CREATE INDEX IF NOT EXISTS idx_logs_time_log_id ON logs (time, log_id);
+        DROP INDEX IF EXISTS idx_logs_time;
+    """),
+    ("0006_live_logs", """
+        CREATE TABLE IF NOT EXISTS live_logs (
+            log_id UUID,
+            time TIMESTAMPTZ,
+            PRIMARY KEY (log_id, time)
+        );
+    """),
+    ("0007_lock_dirty_rollup_minutes", MARK_USER_ROLLUPS_DIRTY_DDL),
+]
+
+
+def applied_migrations(conn):
+    cursor = conn.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                        name TEXT PRIMARY KEY,
+                        applied_at TIMESTAMPTZ DEFAULT now())""")
+    conn.commit()
+    cursor.execute("SELECT name FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn):
+    """
+    Applies every pending migration, returns the names of the ones applied.
+    """
+    applied = applied_migrations(conn)
+    newly_applied = []
+    for name, sql in MIGRATIONS:
+        if name in applied:
+            continue
+        print(f"> applying {name}.", flush=True)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+            cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+            conn.commit()
+        except psycopg2.Error:
+            conn.rollback()
+            raise
+        newly_applied.append(name)
+    return newly_applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Applies pending schema migrations.")
+    parser.add_argument("--host", default="localhost")
+    args = parser.parse_args()
+    conn = psycopg2.connect(host=args.host, **DATABASE)
+    try:
+        newly_applied = migrate(conn)
+    finally:
+        conn.close()
+    print(f"> {len(newly_applied)} migration(s) applied.", flush=True)
+
+
+if __name__ == "__main__":
+    main()
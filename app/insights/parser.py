@@ -0,0 +1,360 @@
+"""
+Combat.log and Misc.log parsing shared by the cron importer and the Streamlit import page.
+
+The parsers work on plain iterables of decoded lines, so callers can feed file lines,
+str.splitlines() or any other line source. Files on disk are read through map_log_file and
+candidate_lines, which only decode the lines containing a marker token.
+"""
+import bisect
+import codecs
+import collections
+import contextlib
+import functools
+import heapq
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+PARSE_CHUNK_BYTES = 32 * 1024 * 1024  # bytes of Combat.log parsed per task in parallel mode
+
+# Both logs are decoded the same way, names read from Misc.log must hash like the ones in Combat.log
+LOG_ENCODING = "utf8"
+COMBAT_MARKERS = (b"attacked", b"targeted")
+LOCATION_MARKERS = (b"Entering Chat: ", b"Leaving Chat: ")
+KILL_MARKERS = (b" has killed ",)
+CANDIDATE_BLOCK_BYTES = 1024 * 1024  # bytes scanned at once by candidate_lines
+DECODE_CHUNK_BYTES = 1024 * 1024  # bytes read at once by iter_decoded_lines
+
+DAMAGE_REGEX = re.compile(r"<(?P<log_time_str>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?P<character>.*?)\|r attacked (?P<receiver>.*?)\|r using \|cff25fcff(.*?)\|r and caused \|cffff0000\-(?P<total>\d+)")
+HEAL_REGEX = re.compile(r"<(?P<log_time_str>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?P<character>.*?)\|r targeted (?P<receiver>[^|]+)\|[^|]+\|cff25fcff(?P<ability>[^|]+)\|[^|]+\|cff00ff00(?P<restored>[^|]+)\|r health.")
+ENTER_REGEX = re.compile(r"<(?P<log_timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})Entering Chat: \d+\.(?P<filter>Shout)\. (?P<log_location>[\w\s]+)")
+LEAVE_REGEX = re.compile(r"<(?P<log_timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})Leaving Chat: \d+\.(?P<filter>Shout)\. (?P<log_location>[\w\s]+)")
+LINE_TIMESTAMP_REGEX = re.compile(rb"<(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})")
+KILL_REGEX = re.compile(r'<\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(.*?) has killed (.*?), totaling \d+ kill\(s\)!')
+NATION_FACTIONS = dict(Nuia='West', Haranya='East', Pirate='Pirate')
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_timestamp(text):
+    """
+    Parses a 'YYYY-MM-DD HH:MM:SS' timestamp matched by the log regexes.
+    The layout is fixed, so the fields are sliced instead of going through strptime, and consecutive
+    log lines share the same second, so results are cached.
+    """
+    return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                    int(text[11:13]), int(text[14:16]), int(text[17:19]))
+
+
+@contextlib.contextmanager
+def map_log_file(file_path):
+    """
+    Maps a log file read-only into memory, an empty file maps to b"".
+    """
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def complete_end(data, start=0, end=None):
+    """
+    Returns the offset after the last complete line in data[start:end], or start if there is none.
+    """
+    end = len(data) if end is None else end
+    return data.rfind(b"\n", start, end) + 1 or start
+
+
+def last_timestamp(data, start=0, end=None):
+    """
+    Returns the time of the last complete line in data[start:end] that starts with a timestamp, or None.
+    Lines are scanned backwards from the end, so only the tail of the file is read.
+    """
+    line_end = complete_end(data, start, end)
+    while line_end > start:
+        newline = data.rfind(b"\n", start, line_end - 1)
+        line_start = newline + 1 if newline >= 0 else start
+        match = LINE_TIMESTAMP_REGEX.match(data, line_start, line_end)
+        if match:
+            return parse_timestamp(match.group(1).decode("ascii"))
+        line_end = line_start
+    return None
+
+
+def iter_decoded_lines(file, encoding=LOG_ENCODING, chunk_size=DECODE_CHUNK_BYTES):
+    """
+    Lazily decodes a binary file-like object chunk by chunk and yields its lines without newlines.
+    Only one chunk and the line it cuts through are held in memory, the file position tells the progress.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    while True:
+        chunk = file.read(chunk_size)
+        lines = (pending + decoder.decode(chunk, final=not chunk)).split("\n")
+        pending = lines.pop()
+        yield from lines
+        if not chunk:
+            break
+    if pending:
+        yield pending
+
+
+def _find_candidates(block, base, markers, encoding):
+    """
+    Jumps from marker to marker with bytes.find, for blocks where few lines are candidates.
+    """
+    size = len(block)
+    positions = [block.find(marker) for marker in markers]
+    positions = [position if position >= 0 else size for position in positions]
+    while True:
+        hit = min(positions)
+        if hit >= size:
+            return
+        line_start = block.rfind(b"\n", 0, hit) + 1
+        line_end = block.find(b"\n", hit)
+        yield base + line_start, base + line_end + 1, block[line_start:line_end].decode(encoding, errors="replace")
+        for i, position in enumerate(positions):
+            if position <= line_end:
+                position = block.find(markers[i], line_end + 1)
+                positions[i] = position if position >= 0 else size
+
+
+def _split_candidates(block, base, markers, encoding):
+    """
+    Splits the block into lines and tests them on bytes, for blocks where most lines are candidates.
+    """
+    line_offset = base
+    for raw_line in block.split(b"\n")[:-1]:
+        next_offset = line_offset + len(raw_line) + 1
+        for marker in markers:
+            if marker in raw_line:
+                yield line_offset, next_offset, raw_line.decode(encoding, errors="replace")
+                break
+        line_offset = next_offset
+
+
+def candidate_lines(data, markers, start=0, end=None, encoding=LOG_ENCODING):
+    """
+    Yields (line_offset, next_offset, line) for the complete lines of data[start:end] containing any of
+    the marker byte strings, lines are decoded without their newline and only when they are candidates.
+    The data is scanned in blocks of whole lines, sparse blocks are searched marker to marker and dense
+    ones are split, whichever costs less Python work per candidate.
+    """
+    end = len(data) if end is None else end
+    block_start = start
+    while block_start < end:
+        block_end = complete_end(data, block_start, min(block_start + CANDIDATE_BLOCK_BYTES, end))
+        if block_end == block_start:
+            # A line longer than the block, or a partially written last line left for the next run
+            block_end = data.find(b"\n", block_start, end) + 1
+            if block_end == 0:
+                return
+        block = data[block_start:block_end]
+        hits = sum(block.count(marker) for marker in markers)
+        if hits * 4 >= block.count(b"\n"):
+            yield from _split_candidates(block, block_start, markers, encoding)
+        elif hits:
+            yield from _find_candidates(block, block_start, markers, encoding)
+        block_start = block_end
+
+
+def parse_combat_line(line):
+    """
+    Parses one Combat.log line into a (log_type, time, character, receiver, total) log, or None.
+    """
+    if "attacked" in line:
+        match_damage = DAMAGE_REGEX.search(line)
+        if match_damage:
+            log_time_str, character, receiver, _, total = match_damage.groups()
+            return ("Damage", parse_timestamp(log_time_str), character.strip(), receiver.strip(), total.strip())
+    if "targeted" in line:
+        match_heal = HEAL_REGEX.search(line)
+        if match_heal:
+            log_time_str, character, receiver, _, restored = match_heal.groups()
+            return ("Heal", parse_timestamp(log_time_str), character.strip(), receiver.strip(), restored.strip())
+    return None
+
+
+def combat_log_matches(combat_log, start_time=None, end_time=None, target_name=None):
+    """
+    Filters logs based on start_time, end_time, and target_name.
+    """
+    return (not start_time or combat_log[1] >= start_time) and (not end_time or combat_log[1] <= end_time) \
+        and (not target_name or combat_log[3] == target_name)
+
+
+def parse_combat(lines, start_time=None, end_time=None, target_name=None):
+    """
+    Lazily parses Combat.log lines into (log_type, time, character, receiver, total) logs.
+    """
+    for line in lines:
+        combat_log = parse_combat_line(line)
+        if combat_log is not None and combat_log_matches(combat_log, start_time, end_time, target_name):
+            yield combat_log
+
+
+def split_line_ranges(file_path, start, end, chunk_size=PARSE_CHUNK_BYTES):
+    """
+    Splits the bytes [start, end) of a file into ranges of about chunk_size bytes that start and end
+    right after a newline, so every line falls whole into one range.
+    """
+    ranges = []
+    with open(file_path, "rb") as file:
+        while start < end:
+            cut = start + chunk_size
+            if cut >= end:
+                ranges.append((start, end))
+                break
+            file.seek(cut)
+            cut += len(file.readline())
+            ranges.append((start, min(cut, end)))
+            start = cut
+    return ranges
+
+
+def parse_combat_range(file_path, encoding, start, end):
+    """
+    Parses the complete Combat.log lines within the bytes [start, end) of a file.
+    Returns (end_offset, [(line_offset, combat_log), ...]), end_offset being the end of the last complete line.
+    """
+    combat_logs = []
+    with map_log_file(file_path) as data:
+        end = min(end, len(data))
+        for line_offset, _, line in candidate_lines(data, COMBAT_MARKERS, start, end, encoding):
+            combat_log = parse_combat_line(line)
+            if combat_log is not None:
+                combat_logs.append((line_offset, combat_log))
+        return complete_end(data, start, end), combat_logs
+
+
+def parse_combat_file_parallel(file_path, encoding, start, end, workers, chunk_size=PARSE_CHUNK_BYTES):
+    """
+    Parses the bytes [start, end) of a Combat.log over a pool of worker processes.
+    The file is cut at newline-aligned ranges and the (end_offset, [(line_offset, combat_log), ...]) results
+    are yielded in file order. At most two ranges per worker are in flight, so memory stays bounded when
+    the consumer is slower than the parsers.
+    """
+    ranges = iter(split_line_ranges(file_path, start, end, chunk_size))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for range_start, range_end in ranges:
+            pending.append(executor.submit(parse_combat_range, file_path, encoding, range_start, range_end))
+            if len(pending) >= workers * 2:
+                break
+        try:
+            while pending:
+                result = pending.popleft().result()
+                next_range = next(ranges, None)
+                if next_range is not None:
+                    pending.append(executor.submit(parse_combat_range, file_path, encoding, *next_range))
+                yield result
+        finally:
+            # The consumer may stop early, e.g. at the tail horizon
+            for future in pending:
+                future.cancel()
+
+
+def parse_location(lines):
+    """
+    Parses Misc.log (tag, line) pairs into [location, enter, exit, tag] sessions ordered by enter.
+    The tag of the enter line is kept with its session, the cron importer passes byte offsets.
+    Each leave closes the open session of its location, sessions never left keep exit as None.
+    """
+    sessions = []
+    open_sessions = {}
+    for tag, line in lines:
+        if line.startswith('BackupNameAttachment'):
+            continue
+        match_enter = ENTER_REGEX.match(line)
+        if match_enter:
+            log_timestamp, _, log_location = match_enter.groups()
+            log_location = log_location.strip()  # Remove leading and trailing whitespace
+            open_sessions[log_location] = len(sessions)
+            sessions.append([log_location, parse_timestamp(log_timestamp), None, tag])
+            continue
+
+        match_leave = LEAVE_REGEX.match(line)
+        if match_leave:
+            log_timestamp, _, log_location = match_leave.groups()
+            log_location = log_location.strip()  # Remove leading and trailing whitespace
+            session = open_sessions.pop(log_location, None)
+            if session is not None:
+                sessions[session][2] = parse_timestamp(log_timestamp)
+    return [tuple(session) for session in sessions]
+
+
+def parse_kill_factions(lines):
+    """
+    Parses Misc.log kill announcements into a {player: faction} dict, the latest kill of a player wins.
+    """
+    factions = {}
+    for line in lines:
+        match = KILL_REGEX.search(line)
+        if not match:
+            continue
+        for announced in match.groups():
+            nation, _, player = announced.strip().partition(' ')
+            faction = NATION_FACTIONS.get(nation)
+            player = player.split(' ')[0].strip()
+            if faction and player:
+                factions[player] = faction
+    return factions
+
+
+def build_location_index(sessions):
+    """
+    Builds a sorted interval index of location sessions for find_location.
+    Each boundary time and each gap between boundaries gets the first session in list order that covers it,
+    so overlapping sessions keep first-match-wins.
+    """
+    windows = []
+    for order, (location, enter_time, exit_time, *_) in enumerate(sessions):
+        if enter_time is None or exit_time is None or enter_time > exit_time:
+            continue
+        windows.append((enter_time, exit_time, order, location))
+    windows.sort()
+    points = sorted({time for window in windows for time in window[:2]})
+    point_locations = []
+    gap_locations = []
+    active = []
+    next_window = 0
+    for point in points:
+        while next_window < len(windows) and windows[next_window][0] == point:
+            enter_time, exit_time, order, location = windows[next_window]
+            heapq.heappush(active, (order, exit_time, location))
+            next_window += 1
+        while active and active[0][1] < point:
+            heapq.heappop(active)
+        point_locations.append(active[0][2] if active else None)
+        while active and active[0][1] <= point:
+            heapq.heappop(active)
+        gap_locations.append(active[0][2] if active else None)
+    return points, point_locations, gap_locations
+
+
+def find_location(location_index, log_time):
+    """
+    Finds the location of a log time in an index built by build_location_index.
+    """
+    points, point_locations, gap_locations = location_index
+    i = bisect.bisect_right(points, log_time) - 1
+    if i < 0:
+        return None
+    if points[i] == log_time:
+        return point_locations[i]
+    return gap_locations[i]
+
+
+def merge_logs(combat_logs, sessions):
+    """
+    Lazily merges combat logs with location sessions, combat outside every session is dropped.
+    """
+    location_index = build_location_index(sessions)
+    for combat_log in combat_logs:
+        location = find_location(location_index, combat_log[1])
+        if location is not None:
+            yield combat_log + (location,)
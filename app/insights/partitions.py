@@ -0,0 +1,121 @@
+"""
+Weekly range partitions of the logs table.
+
+Partitions are named logs_YYYYMMDD after the Monday they start on and cover [monday, next monday)
+in the database timezone. There is no default partition: writers call ensure_log_partitions for the
+times they are about to insert, and the cron runner keeps the upcoming weeks created ahead of time.
+"""
+from datetime import date, datetime, timedelta
+
+PARTITION_INTERVAL = timedelta(weeks=1)
+PARTITION_PREMAKE_WEEKS = 4  # weeks created ahead of the current one
+LOG_RETENTION_WEEKS = 52  # partitions ending before this many weeks ago are detached and archived
+
+LOGS_TABLE_DDL = '''CREATE TABLE IF NOT EXISTS logs (
+                        log_type TEXT,
+                        time TIMESTAMPTZ NOT NULL,
+                        character TEXT,
+                        receiver TEXT,
+                        total INTEGER,
+                        location TEXT,
+                        log_id UUID,
+                        character_id UUID,
+                        receiver_id UUID,
+                        PRIMARY KEY (log_id, time)
+                    ) PARTITION BY RANGE (time)'''
+
+
+def week_start(moment):
+    """
+    Returns the Monday starting the partition of a date, datetime or 'YYYY-MM-DD ...' string.
+    """
+    if isinstance(moment, str):
+        moment = date.fromisoformat(moment[:10])
+    elif isinstance(moment, datetime):
+        moment = moment.date()
+    return moment - timedelta(days=moment.weekday())
+
+
+def partition_name(start):
+    return f"logs_{start:%Y%m%d}"
+
+
+def existing_log_partitions(conn):
+    """
+    Returns the names of the partitions currently attached to logs.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'logs'::regclass
+    """)
+    return {row[0] for row in cursor.fetchall()}
+
+
+def ensure_log_partitions(conn, times):
+    """
+    Creates the missing weekly partitions needed to insert rows with the given times.
+    The caller commits. Returns the names of the partitions created.
+    """
+    starts = {week_start(moment) for moment in times}
+    if not starts:
+        return []
+    existing = existing_log_partitions(conn)
+    created = []
+    cursor = conn.cursor()
+    for start in sorted(starts):
+        name = partition_name(start)
+        if name in existing:
+            continue
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF logs FOR VALUES FROM (%s) TO (%s)",
+            (start.isoformat(), (start + PARTITION_INTERVAL).isoformat())
+        )
+        created.append(name)
+    return created
+
+
+def create_upcoming_log_partitions(conn, today=None, weeks_ahead=PARTITION_PREMAKE_WEEKS):
+    """
+    Creates the partitions of the current week and the next weeks_ahead weeks. The caller commits.
+    """
+    first = week_start(today or date.today())
+    return ensure_log_partitions(conn, [first + PARTITION_INTERVAL * i for i in range(weeks_ahead + 1)])
+
+
+def retention_cutoff(today=None, retention_weeks=LOG_RETENTION_WEEKS):
+    """
+    Returns the Monday before which weeks are archived. Rows older than it are not imported again.
+    """
+    return week_start(today or date.today()) - PARTITION_INTERVAL * retention_weeks
+
+
+def detach_old_log_partitions(conn, today=None, retention_weeks=LOG_RETENTION_WEEKS):
+    """
+    Detaches partitions that ended more than retention_weeks ago and keeps them as logs_archive_YYYYMMDD
+    tables, out of the reach of report queries and insert conflict checks. The caller commits.
+    Returns the names of the archive tables written.
+    """
+    cutoff = retention_cutoff(today, retention_weeks)
+    cursor = conn.cursor()
+    archived = []
+    for name in sorted(existing_log_partitions(conn)):
+        try:
+            start = datetime.strptime(name, "logs_%Y%m%d").date()
+        except ValueError:
+            continue
+        if start + PARTITION_INTERVAL > cutoff:
+            continue
+        archive_name = f"logs_archive_{start:%Y%m%d}"
+        cursor.execute(f"ALTER TABLE logs DETACH PARTITION {name}")
+        cursor.execute("SELECT to_regclass(%s)", (archive_name,))
+        if cursor.fetchone()[0] is None:
+            cursor.execute(f"ALTER TABLE {name} RENAME TO {archive_name}")
+        else:
+            # The week was archived before and rows for it were imported again since
+            cursor.execute(f"INSERT INTO {archive_name} SELECT * FROM {name} ON CONFLICT DO NOTHING")
+            cursor.execute(f"DROP TABLE {name}")
+        archived.append(archive_name)
+    return archived
@@ -0,0 +1,87 @@
+"""
+Composable report filters rendered as bound parameters, run through server side prepared statements.
+
+Values never go into the SQL text, so a filter combination always produces the same statement and
+PostgreSQL parses and plans it once per connection instead of once per query.
+"""
+import hashlib
+import itertools
+import re
+import threading
+
+PREPARED_STATEMENTS_MAX = 200  # statements kept prepared per connection before they are all deallocated
+
+
+class QueryFilter:
+    """
+    Collects AND-ed WHERE conditions with %s placeholders and their parameters.
+    Conditions for empty values are skipped, so optional report filters can be added unconditionally.
+    """
+
+    def __init__(self):
+        self.conditions = []
+        self.params = []
+
+    def add(self, condition, *params):
+        self.conditions.append(condition)
+        self.params.extend(params)
+        return self
+
+    def equals(self, column, value):
+        if value:
+            self.add(f"{column} = %s", value)
+        return self
+
+    def any_of(self, column, values):
+        values = [value for value in values or [] if value]
+        if values:
+            self.add(f"{column} = ANY(%s)", values)
+        return self
+
+    def at_least(self, column, value):
+        if value:
+            self.add(f"{column} >= %s", value)
+        return self
+
+    def at_most(self, column, value):
+        if value:
+            self.add(f"{column} <= %s", value)
+        return self
+
+    def sql(self, keyword="WHERE"):
+        """
+        Returns the conditions prefixed with keyword, or an empty string when there are none.
+        """
+        if not self.conditions:
+            return ""
+        return f" {keyword} " + " AND ".join(self.conditions)
+
+
+_prepared = {}
+_prepared_lock = threading.Lock()
+
+
+def execute_prepared(cursor, query, params=()):
+    """
+    Executes query through a prepared statement named after its text, prepared the first time the
+    connection runs it. query takes %s placeholders only, literal percent signs are not supported.
+    """
+    conn = cursor.connection
+    name = "report_" + hashlib.md5(query.encode()).hexdigest()[:20]
+    with _prepared_lock:
+        prepared = _prepared.setdefault((id(conn), conn.info.backend_pid), set())
+        deallocate = name not in prepared and len(prepared) >= PREPARED_STATEMENTS_MAX
+        if deallocate:
+            prepared.clear()
+        is_prepared = name in prepared
+    if deallocate:
+        cursor.execute("DEALLOCATE ALL")
+    if not is_prepared:
+        position = itertools.count(1)
+        cursor.execute(f"PREPARE {name} AS " + re.sub(r"%s", lambda _: f"${next(position)}", query))
+        with _prepared_lock:
+            prepared.add(name)
+    if params:
+        cursor.execute(f"EXECUTE {name} (" + ", ".join(["%s"] * len(params)) + ")", list(params))
+    else:
+        cursor.execute(f"EXECUTE {name}")
@@ -0,0 +1,128 @@
+"""
+Pre-aggregated rollups of the logs table for the dashboard reports.
+
+log_rollup_character keeps per minute x location x log_type x character x receiver faction totals,
+log_rollup_minute the same per character faction. Both are maintained incrementally: the COPY loader
+marks the minutes it writes in log_rollup_dirty, a trigger on users marks the minutes of a user whose
+faction changes, and refresh_log_rollups recomputes only the marked minutes.
+"""
+
+# Upserting the dirty minute locks its row until the writer commits, a refresh claiming it meanwhile waits
+MARK_USER_ROLLUPS_DIRTY_DDL = '''CREATE OR REPLACE FUNCTION mark_user_rollups_dirty() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO log_rollup_dirty (bucket)
+            SELECT DISTINCT date_trunc('minute', time) FROM logs
+            WHERE character_id = NEW.user_hash OR receiver_id = NEW.user_hash
+            ON CONFLICT (bucket) DO UPDATE SET bucket = EXCLUDED.bucket;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql'''
+
+ROLLUP_DDL = [
+    '''CREATE TABLE IF NOT EXISTS log_rollup_dirty (
+        bucket TIMESTAMPTZ PRIMARY KEY)''',
+    '''CREATE TABLE IF NOT EXISTS log_rollup_character (
+        bucket TIMESTAMPTZ NOT NULL,
+        location TEXT,
+        log_type TEXT,
+        character_id UUID,
+        receiver_faction TEXT,
+        total BIGINT,
+        log_count BIGINT)''',
+    '''CREATE TABLE IF NOT EXISTS log_rollup_minute (
+        bucket TIMESTAMPTZ NOT NULL,
+        location TEXT,
+        log_type TEXT,
+        faction TEXT,
+        receiver_faction TEXT,
+        total BIGINT,
+        log_count BIGINT)''',
+    "CREATE INDEX IF NOT EXISTS idx_log_rollup_character_bucket ON log_rollup_character (bucket)",
+    "CREATE INDEX IF NOT EXISTS idx_log_rollup_minute_bucket ON log_rollup_minute (bucket)",
+    MARK_USER_ROLLUPS_DIRTY_DDL,
+    "DROP TRIGGER IF EXISTS users_faction_insert_rollups ON users",
+    '''CREATE TRIGGER users_faction_insert_rollups AFTER INSERT ON users
+        FOR EACH ROW WHEN (NEW.faction IS NOT NULL) EXECUTE FUNCTION mark_user_rollups_dirty()''',
+    "DROP TRIGGER IF EXISTS users_faction_update_rollups ON users",
+    '''CREATE TRIGGER users_faction_update_rollups AFTER UPDATE OF faction ON users
+        FOR EACH ROW WHEN (OLD.faction IS DISTINCT FROM NEW.faction) EXECUTE FUNCTION mark_user_rollups_dirty()''',
+]
+
+
+def create_rollup_tables(conn):
+    """
+    Creates the rollup tables and the users trigger keeping them in sync with faction changes.
+    The users and logs tables must exist. The caller commits.
+    """
+    cursor = conn.cursor()
+    for statement in ROLLUP_DDL:
+        cursor.execute(statement)
+
+
+def mark_staged_rollups_dirty(conn, staging):
+    """
+    Marks the minutes of staged log rows for the next rollup refresh. An already dirty minute is
+    updated rather than skipped, so a refresh cannot claim it before these rows are committed.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        INSERT INTO log_rollup_dirty (bucket)
+        SELECT DISTINCT date_trunc('minute', time) FROM {staging}
+        ON CONFLICT (bucket) DO UPDATE SET bucket = EXCLUDED.bucket
+    """)
+
+
+def refresh_log_rollups(conn):
+    """
+    Recomputes the rollups of every minute marked dirty. The caller commits.
+    Returns the number of minutes refreshed.
+    """
+    cursor = conn.cursor()
+    # Concurrent refreshes would rebuild the same minutes twice, they wait for each other until commit
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('log_rollups'))")
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS log_rollup_refresh (bucket TIMESTAMPTZ PRIMARY KEY)")
+    cursor.execute("TRUNCATE log_rollup_refresh")
+    cursor.execute("""
+        WITH claimed AS (DELETE FROM log_rollup_dirty RETURNING bucket)
+        INSERT INTO log_rollup_refresh (bucket) SELECT bucket FROM claimed
+    """)
+    refreshed = cursor.rowcount
+    if refreshed == 0:
+        return 0
+    cursor.execute("ANALYZE log_rollup_refresh")
+    cursor.execute("DELETE FROM log_rollup_character WHERE bucket IN (SELECT bucket FROM log_rollup_refresh)")
+    cursor.execute("DELETE FROM log_rollup_minute WHERE bucket IN (SELECT bucket FROM log_rollup_refresh)")
+    cursor.execute("""
+        INSERT INTO log_rollup_character (bucket, location, log_type, character_id, receiver_faction, total, log_count)
+        SELECT refresh.bucket, logs.location, logs.log_type, logs.character_id, recv_users.faction,
+               SUM(logs.total), COUNT(*)
+        FROM log_rollup_refresh AS refresh
+        JOIN logs ON logs.time >= refresh.bucket AND logs.time < refresh.bucket + INTERVAL '1 minute'
+        LEFT JOIN users AS recv_users ON recv_users.user_hash = logs.receiver_id
+        GROUP BY refresh.bucket, logs.location, logs.log_type, logs.character_id, recv_users.faction
+    """)
+    cursor.execute("""
+        INSERT INTO log_rollup_minute (bucket, location, log_type, faction, receiver_faction, total, log_count)
+        SELECT rollup.bucket, rollup.location, rollup.log_type, users.faction, rollup.receiver_faction,
+               SUM(rollup.total), SUM(rollup.log_count)
+        FROM log_rollup_character AS rollup
+        JOIN log_rollup_refresh AS refresh ON refresh.bucket = rollup.bucket
+        LEFT JOIN users ON users.user_hash = rollup.character_id
+        GROUP BY rollup.bucket, rollup.location, rollup.log_type, users.faction, rollup.receiver_faction
+    """)
+    cursor.execute("TRUNCATE log_rollup_refresh")
+    return refreshed
+
+
+def prune_log_rollups(conn, cutoff):
+    """
+    Deletes the rollups and dirty marks of the minutes before cutoff, whose logs were archived. The caller commits.
+    Returns the number of rollup rows deleted.
+    """
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM log_rollup_dirty WHERE bucket < %s", (cutoff.isoformat(),))
+    deleted = 0
+    for table in ("log_rollup_character", "log_rollup_minute"):
+        cursor.execute(f"DELETE FROM {table} WHERE bucket < %s", (cutoff.isoformat(),))
+        deleted += cursor.rowcount
+    return deleted
@@ -0,0 +1,113 @@
+"""
+Concurrent scheduler for the cron importer jobs.
+
+Every job runs on its own interval on a thread pool, so a slow log import does not hold back the
+lighter user jobs. A run is skipped while the previous run of the same job is still going, in this
+process or in any other one sharing the database, through a PostgreSQL advisory lock named after the job.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from insights.db import advisory_unlock, try_advisory_lock
+
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", 4))
+SCHEDULER_JITTER = float(os.environ.get("SCHEDULER_JITTER", 30))  # max seconds added to every run's start
+SCHEDULER_POLL_SECONDS = 1
+
+
+def job_interval(name, default):
+    """
+    Returns the interval in seconds of a job, overridden by the <NAME>_INTERVAL environment variable.
+    """
+    return float(os.environ.get(f"{name.upper()}_INTERVAL", default))
+
+
+class ScheduledJob:
+    """
+    A function run every interval seconds, first after initial_delay seconds, each start delayed by up to jitter seconds.
+    """
+
+    def __init__(self, name, func, interval, initial_delay=0, jitter=0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.next_run = time.monotonic() + initial_delay + self.next_jitter()
+        self.running = False
+        self.last_duration = None
+
+    def next_jitter(self):
+        return random.uniform(0, self.jitter) if self.jitter > 0 else 0
+
+
+class Scheduler:
+    """
+    Runs ScheduledJobs concurrently on a thread pool, each with a random start jitter of up to jitter seconds.
+    Connections for the job locks are checked out from db_pool.
+    """
+
+    def __init__(self, db_pool, workers=SCHEDULER_WORKERS, jitter=SCHEDULER_JITTER):
+        self._db_pool = db_pool
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cron")
+        self._jitter = jitter
+        self._jobs = []
+        self._lock = threading.Lock()
+
+    def every(self, interval, func, name=None, initial_delay=0, jitter=None):
+        """
+        Schedules func to run every interval seconds, jitter defaults to the scheduler's. Returns the ScheduledJob.
+        """
+        jitter = self._jitter if jitter is None else jitter
+        job = ScheduledJob(name or func.__name__, func, interval, initial_delay, jitter)
+        self._jobs.append(job)
+        return job
+
+    def run_pending(self):
+        """
+        Submits every due job that is not already running in this process.
+        """
+        now = time.monotonic()
+        for job in self._jobs:
+            with self._lock:
+                if job.running or job.next_run > now:
+                    continue
+                job.running = True
+                job.next_run = now + job.interval + job.next_jitter()
+            self._executor.submit(self._run, job)
+
+    def run_forever(self, poll=SCHEDULER_POLL_SECONDS):
+        while True:
+            self.run_pending()
+            time.sleep(poll)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _run(self, job):
+        try:
+            with self._db_pool.connection() as lock_conn:
+                if not try_advisory_lock(lock_conn, f"cron:{job.name}"):
+                    print(f"> {self._timestamp()}: {job.name} is still running elsewhere, skipped.", flush=True)
+                    return
+                started = time.monotonic()
+                try:
+                    job.func()
+                finally:
+                    job.last_duration = time.monotonic() - started
+                    advisory_unlock(lock_conn, f"cron:{job.name}")
+            if job.last_duration > job.interval:
+                print(f"> {self._timestamp()}: {job.name} took {job.last_duration:.0f}s, longer than its "
+                      f"{job.interval:.0f}s interval.", flush=True)
+        except Exception as e:
+            print(f"> {self._timestamp()}: {job.name} failed:", e, flush=True)
+        finally:
+            with self._lock:
+                job.running = False
+
+    @staticmethod
+    def _timestamp():
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
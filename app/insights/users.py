@@ -0,0 +1,76 @@
+"""
+Process level dictionary of user name hashes, so importers only hash and upsert names they have not seen.
+"""
+import hashlib
+import threading
+
+WARM_FETCH_SIZE = 10000  # users streamed per round trip while warming
+
+
+def hash_user_name(user_name):
+    """
+    Hashes a user name into its users.user_hash, the MD5 hex digest of the name.
+    """
+    return hashlib.md5(user_name.encode()).hexdigest()
+
+
+class UserDirectory:
+    """
+    Thread safe map of user name to user_hash, remembering which names are already stored in users.
+    Warm it from the users table once, then hash names through user_hash, upsert only the rows
+    returned by new_users and record them with mark_stored after the commit.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._stored = set()
+        self._lock = threading.Lock()
+        self.warmed = False
+
+    def warm(self, conn):
+        """
+        Loads every stored user, replacing what was known. Returns the number of users loaded.
+        """
+        hashes = {}
+        # Named cursor, the users table is streamed instead of fetched into memory at once
+        with conn.cursor(name="user_directory_warm") as cursor:
+            cursor.itersize = WARM_FETCH_SIZE
+            cursor.execute("SELECT user_name, replace(user_hash::text, '-', '') FROM users WHERE user_name IS NOT NULL")
+            for user_name, user_hash in cursor:
+                hashes[user_name] = user_hash
+        conn.commit()
+        with self._lock:
+            self._hashes = hashes
+            self._stored = set(hashes)
+            self.warmed = True
+        return len(hashes)
+
+    def user_hash(self, user_name):
+        """
+        Returns the user_hash of a name, hashing it only the first time the name is seen.
+        """
+        user_hash = self._hashes.get(user_name)
+        if user_hash is None:
+            user_hash = hash_user_name(user_name)
+            with self._lock:
+                self._hashes[user_name] = user_hash
+        return user_hash
+
+    def new_users(self, user_rows):
+        """
+        Filters (user_hash, user_name) rows down to the names not stored in users yet.
+        """
+        stored = self._stored
+        return {(user_hash, user_name) for user_hash, user_name in user_rows if user_name not in stored}
+
+    def mark_stored(self, user_rows):
+        """
+        Records (user_hash, user_name) rows as stored in users, call it once their insert is committed.
+        """
+        with self._lock:
+            for user_hash, user_name in user_rows:
+                self._hashes[user_name] = user_hash
+                self._stored.add(user_name)
+
+    def __len__(self):
+        return len(self._stored)